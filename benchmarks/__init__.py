@@ -0,0 +1,2 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
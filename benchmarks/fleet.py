@@ -0,0 +1,278 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Synthetic manager data and a local stand-in for the manager API.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import re
+import threading
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+OPENSTACK_CREDENTIALS = """
+OS_PROJECT_DOMAIN_ID: default
+OS_AUTH_URL: https://openstack.example.org:25000/v3
+OS_PASSWORD: password
+OS_REGION_NAME: region1
+OS_USERNAME: prometheus
+"""
+
+
+def create_main_config(directory: Path) -> dict[str, Any]:
+    """Create a configurator config with its OpenStack credentials in directory."""
+    credentials = directory / "openstack.yaml"
+    credentials.write_text(OPENSTACK_CREDENTIALS)
+
+    return {
+        "openstack": {
+            "credentials": str(credentials),
+            "all_tenants_project_name": "admin-monitoring",
+        },
+        "alertmanager_hosts": ["alertmanager.example.org:9093"],
+        "external_labels": {"site": "example"},
+        "alert_routing": {
+            "irc_base": "http://irc.example.org/",
+            "phab_base": "http://phab.example.org/",
+        },
+    }
+
+
+@dataclass
+class Fleet:
+    projects: list[dict[str, Any]] = field(default_factory=list)
+    project_details: dict[int, dict[str, Any]] = field(default_factory=dict)
+    contact_groups: list[dict[str, Any]] = field(default_factory=list)
+    images: list[dict[str, Any]] = field(default_factory=list)
+    global_alerts: list[dict[str, Any]] = field(default_factory=list)
+
+
+def _blackbox_config(rng: random.Random) -> dict[str, Any]:
+    if rng.random() < 0.2:
+        return {
+            "type": "dns",
+            "query_name": "example.org",
+            "query_type": "A",
+            "require_answer_match": None,
+        }
+    return {
+        "type": "http",
+        "method": "GET",
+        "follow_redirects": True,
+        "headers": {},
+        "host": None,
+        "valid_status_codes": [],
+        "require_body_match": None,
+        "require_body_not_match": None,
+    }
+
+
+def _scrape(rng: random.Random, index: int, blackbox_ratio: float) -> dict[str, Any]:
+    scrape: dict[str, Any] = {
+        "name": f"job{index}",
+        "scheme": "http",
+        "path": "/metrics",
+    }
+
+    if rng.random() < blackbox_ratio:
+        scrape["blackbox"] = _blackbox_config(rng)
+        scrape["path"] = "/"
+
+    if rng.random() < 0.5:
+        scrape["openstack_discovery"] = {"port": rng.choice([80, 443, 9100, 9117])}
+    else:
+        scrape["static_discovery"] = [
+            {"host": f"host{i}.example.org", "port": 443}
+            for i in range(rng.randint(1, 3))
+        ]
+
+    return scrape
+
+
+def generate_fleet(
+    project_count: int,
+    scrapes_per_project: int = 3,
+    blackbox_ratio: float = 0.3,
+    alert_rules_per_project: int = 2,
+    contact_groups_per_project: int = 1,
+    image_count: int = 20,
+    seed: int = 0,
+) -> Fleet:
+    rng = random.Random(seed)
+    fleet = Fleet(
+        images=[
+            {"openstack_id": str(uuid.UUID(int=rng.getrandbits(128)))}
+            for _ in range(image_count)
+        ],
+        global_alerts=[
+            {
+                "name": f"GlobalAlert{i}",
+                "expr": f'up{{job="global{i}"}} == 0',
+                "duration": "5m",
+                "annotations": {"summary": "global alert"},
+                "severity": "warn",
+                "mode": "PER_PROJECT" if i % 2 else "GLOBAL",
+            }
+            for i in range(10)
+        ],
+    )
+
+    for project_id in range(1, project_count + 1):
+        name = f"project-{project_id}"
+        project = {
+            "id": project_id,
+            "name": name,
+            "extra_labels": {"team": f"team{project_id % 7}"} if project_id % 5 else {},
+        }
+        fleet.projects.append(project)
+
+        contact_groups = [
+            {
+                "name": f"group{i}",
+                "project": {"name": name},
+                "members": [{"type": "EMAIL", "value": f"admins@{name}.example.org"}],
+            }
+            for i in range(contact_groups_per_project)
+        ]
+        fleet.contact_groups.extend(contact_groups)
+
+        fleet.project_details[project_id] = {
+            **project,
+            "scrapes": [
+                _scrape(rng, i, blackbox_ratio) for i in range(scrapes_per_project)
+            ],
+            "alert_rules": [
+                {
+                    "name": f"Alert{i}",
+                    "expr": f'up{{project="{name}", job="job{i}"}} == 0',
+                    "duration": "5m",
+                    "annotations": {"summary": "instance is down"},
+                    "severity": "warn",
+                }
+                for i in range(alert_rules_per_project)
+            ],
+            "default_contact_group": contact_groups[0] if contact_groups else None,
+            "acl_group": None,
+        }
+
+    return fleet
+
+
+class FakeManager:
+    """Serves a Fleet over the same HTTP API the real manager provides."""
+
+    def __init__(self, fleet: Fleet, change_feed: bool = True):
+        self.fleet = fleet
+        self.request_count = 0
+        self.change_feed = change_feed
+        # ("project", id) or ("collection", name) for every change, the
+        # index after the last one is the change feed cursor
+        self.changes: list[tuple[str, Any]] = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self) -> FakeManager:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update_project(self, details: dict[str, Any]):
+        """Replace the details of a project and record the change."""
+        with self._lock:
+            self.fleet.project_details[details["id"]] = details
+            self.changes.append(("project", details["id"]))
+
+    def record_change(self, collection: str):
+        """Record a change made to one of the lists of the fleet."""
+        with self._lock:
+            self.changes.append(("collection", collection))
+
+    def _changes_since(self, query: dict[str, list[str]]) -> tuple[int, Any]:
+        with self._lock:
+            cursor = len(self.changes)
+            if "since" not in query:
+                return 200, {"cursor": str(cursor)}
+
+            since = query["since"][0]
+            if not since.isdigit() or int(since) > cursor:
+                return 410, {"detail": "Unknown cursor"}
+            changes = self.changes[int(since) :]
+
+        return 200, {
+            "cursor": str(cursor),
+            "projects": list(
+                dict.fromkeys(value for kind, value in changes if kind == "project")
+            ),
+            "collections": list(
+                dict.fromkeys(value for kind, value in changes if kind == "collection")
+            ),
+        }
+
+    def respond(self, path: str, query: dict[str, list[str]]) -> tuple[int, Any]:
+        with self._lock:
+            self.request_count += 1
+
+        if path == "/v1/changes" and self.change_feed:
+            return self._changes_since(query)
+
+        data = self._data(path, query)
+        if data is None:
+            return 404, {"detail": "Not Found"}
+        return 200, data
+
+    def _data(self, path: str, query: dict[str, list[str]]) -> Any:
+        if path == "/v1/projects":
+            if query.get("expand") == ["details"]:
+                return [
+                    self.fleet.project_details[int(project_id)]
+                    for project_id in query.get("id", [])
+                    if int(project_id) in self.fleet.project_details
+                ]
+            return self.fleet.projects
+        match = re.fullmatch(r"/v1/projects/(\d+)", path)
+        if match:
+            return self.fleet.project_details.get(int(match.group(1)))
+        if path == "/v1/contact-groups":
+            return self.fleet.contact_groups
+        if path == "/v1/supported-openstack-images":
+            return self.fleet.images
+        if path == "/v1/global-alerts":
+            return self.fleet.global_alerts
+        return None
+
+    def _handler(self):
+        manager = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, data = manager.respond(url.path, parse_qs(url.query))
+                body = json.dumps(data).encode()
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
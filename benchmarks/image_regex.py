@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Compare the flat and the compact supported image regexes by size and match cost.
+
+Python's backtracking regex engine is used as a stand-in for Prometheus' RE2,
+so the absolute numbers differ but both engines have to consider fewer
+alternatives per character with the compact form.
+
+Run with: python -m benchmarks.image_regex
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import timeit
+import uuid
+
+from prometheus_configurator.regex import compact_alternation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--probes", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+
+    print(
+        f"{'images':>6} {'flat size':>9} {'compact size':>12} "
+        + f"{'flat match (us)':>15} {'compact match (us)':>18}"
+    )
+
+    for image_count in args.images:
+        images = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(image_count)]
+        flat = "|".join(re.escape(image) for image in images)
+        compact = compact_alternation(images)
+
+        # Prometheus anchors relabel regexes on both ends
+        flat_re = re.compile(f"^(?:{flat})$")
+        compact_re = re.compile(f"^(?:{compact})$")
+
+        # Mostly unsupported images, like on a real cloud
+        probes = [
+            (
+                rng.choice(images)
+                if rng.random() < 0.2
+                else str(uuid.UUID(int=rng.getrandbits(128)))
+            )
+            for _ in range(args.probes)
+        ]
+        for probe in probes:
+            assert bool(flat_re.match(probe)) == bool(compact_re.match(probe))
+
+        def cost(pattern: re.Pattern) -> float:
+            seconds = timeit.timeit(
+                lambda: [pattern.match(probe) for probe in probes], number=5
+            )
+            return seconds / (5 * len(probes)) * 1e6
+
+        print(
+            f"{image_count:>6} {len(flat):>9} {len(compact):>12} "
+            + f"{cost(flat_re):>15.2f} {cost(compact_re):>18.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
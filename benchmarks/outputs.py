@@ -0,0 +1,229 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Benchmark fetching the manager data and writing every output for synthetic fleets.
+
+For each fleet size this measures the wall time, peak Python memory use and
+number of HTTP requests made of fetching the manager snapshot, and of writing
+each output into an empty directory ("cold") and again with nothing changed
+("warm"). Fetching is also measured when following the manager change feed
+with a single project changed ("feed"). Results are written as JSON so that
+runs from different commits can be compared with --compare.
+
+Run with: python -m benchmarks.outputs --output results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from benchmarks.fleet import FakeManager, create_main_config, generate_fleet
+from prometheus_configurator import create_output
+from prometheus_configurator.http_cache import ResponseCache
+from prometheus_configurator.manager import PrometheusManagerClient
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+def output_configs(directory: Path) -> list[dict[str, Any]]:
+    for name in ["prometheus", "blackbox", "alertmanager"]:
+        (directory / name).mkdir()
+
+    return [
+        {
+            "kind": "prometheus",
+            "base_directory": str(directory / "prometheus"),
+            "blackbox_address": "localhost:9115",
+            "blackbox_dir": str(directory / "blackbox"),
+            "blackbox_reload": "/bin/true",
+            "fqdn_template": "{instance}.{project}.example.org",
+        },
+        {
+            "kind": "alertmanager",
+            "base_directory": str(directory / "alertmanager"),
+        },
+        {
+            "kind": "karma_acl",
+            "acl_file_path": str(directory / "alertmanager" / "acl.yml"),
+        },
+        {
+            "kind": "thanos_rule",
+            "alert_file_path": str(directory / "alertmanager" / "thanos.yml"),
+        },
+    ]
+
+
+def measure(
+    function: Callable[[], Any], manager: FakeManager, memory: bool
+) -> tuple[Any, dict[str, Any]]:
+    requests_before = manager.request_count
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result = function()
+    wall_time = time.perf_counter() - start
+
+    peak_memory = None
+    if memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return result, {
+        "wall_seconds": round(wall_time, 6),
+        "peak_memory_bytes": peak_memory,
+        "http_requests": manager.request_count - requests_before,
+    }
+
+
+def run_fleet(args: argparse.Namespace, project_count: int) -> list[dict[str, Any]]:
+    fleet = generate_fleet(
+        project_count,
+        scrapes_per_project=args.scrapes_per_project,
+        blackbox_ratio=args.blackbox_ratio,
+        alert_rules_per_project=args.alert_rules_per_project,
+        contact_groups_per_project=args.contact_groups_per_project,
+    )
+    results = []
+
+    def record(phase: str, run: str, measurements: dict[str, Any]):
+        results.append(
+            {"projects": project_count, "phase": phase, "run": run, **measurements}
+        )
+        print(
+            f"{project_count:>8} {phase:>12} {run:>5} "
+            + f"{measurements['wall_seconds']:>10.3f} "
+            + f"{(measurements['peak_memory_bytes'] or 0) / 2**20:>10.1f} "
+            + f"{measurements['http_requests']:>8}"
+        )
+
+    # Memory is measured in separate runs, as tracing allocations slows
+    # everything down considerably
+    for memory in [False, True] if args.memory else [False]:
+        with FakeManager(fleet) as manager, tempfile.TemporaryDirectory() as temp:
+            directory = Path(temp)
+            main_config = create_main_config(directory)
+
+            snapshot, measurements = measure(
+                lambda: ManagerSnapshot.fetch(PrometheusManagerClient(manager.url)),
+                manager,
+                memory,
+            )
+            record("fetch", "memory" if memory else "cold", measurements)
+
+            if not memory:
+                # Follow the change feed with one project changed since the
+                # previous run
+                client = PrometheusManagerClient(
+                    manager.url,
+                    cache=ResponseCache(directory / "cache"),
+                    change_feed=True,
+                )
+                ManagerSnapshot.fetch(client)
+                manager.update_project(dict(fleet.project_details[1]))
+                _, measurements = measure(
+                    lambda: ManagerSnapshot.fetch(client), manager, memory
+                )
+                record("fetch", "feed", measurements)
+
+            for output_config in output_configs(directory):
+                output = create_output(output_config, main_config)
+                for run in ["cold"] if memory else ["cold", "warm"]:
+                    _, measurements = measure(
+                        lambda: output.write(snapshot), manager, memory
+                    )
+                    record(
+                        output_config["kind"],
+                        "memory" if memory else run,
+                        measurements,
+                    )
+
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path: Path, results: list[dict[str, Any]]):
+    with baseline_path.open() as file:
+        baseline = {
+            (result["projects"], result["phase"], result["run"]): result
+            for result in json.load(file)["results"]
+        }
+
+    print(f"\nchange against {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["projects"], result["phase"], result["run"]))
+        if not old:
+            continue
+        for metric in ["wall_seconds", "peak_memory_bytes", "http_requests"]:
+            if old[metric] and result[metric] is not None:
+                print(
+                    f"{result['projects']:>8} {result['phase']:>12} {result['run']:>6} "
+                    + f"{metric:>18}: {result[metric] / old[metric] - 1:+7.1%}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--projects", type=int, nargs="+", default=[100, 1000, 5000, 20000]
+    )
+    parser.add_argument("--scrapes-per-project", type=int, default=3)
+    parser.add_argument("--blackbox-ratio", type=float, default=0.3)
+    parser.add_argument("--alert-rules-per-project", type=int, default=2)
+    parser.add_argument("--contact-groups-per-project", type=int, default=1)
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="Skip the slower peak memory measurements",
+    )
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    parser.add_argument(
+        "--compare", type=Path, help="Compare to the results in this file"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'projects':>8} {'phase':>12} {'run':>5} {'wall (s)':>10} "
+        + f"{'peak (MiB)':>10} {'requests':>8}"
+    )
+
+    results = []
+    for project_count in args.projects:
+        results.extend(run_fleet(args, project_count))
+
+    data = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "parameters": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("output", "compare")
+        },
+        "results": results,
+    }
+    if args.output:
+        with args.output.open(mode="w") as file:
+            json.dump(data, file, indent=2)
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
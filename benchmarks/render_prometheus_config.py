@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Measure how rendering and serializing prometheus.yml scales with the number of projects.
+
+Run with: python -m benchmarks.render_prometheus_config
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from benchmarks.fleet import FakeManager, create_main_config, generate_fleet
+from prometheus_configurator import serialization
+from prometheus_configurator.manager import PrometheusManagerClient
+from prometheus_configurator.prometheus import ConfigFileCreator
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+OUTPUT_CONFIG = {
+    "blackbox_address": "localhost:9115",
+    "fqdn_template": "{instance}.{project}.example.org",
+}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--projects", type=int, nargs="+", default=[100, 1000, 5000, 10000]
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'projects':>8} {'jobs':>7} {'size (MiB)':>10} {'render (s)':>10} "
+        + f"{'python dump (s)':>15} {'libyaml dump (s)':>16}"
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        creator = ConfigFileCreator(create_main_config(Path(temp_dir)))
+
+        for project_count in args.projects:
+            fleet = generate_fleet(project_count)
+            with FakeManager(fleet) as manager:
+                snapshot = ManagerSnapshot.fetch(PrometheusManagerClient(manager.url))
+
+            (config, _), render_time = timed(
+                creator.create_prometheus_config,
+                snapshot.projects,
+                snapshot,
+                ["/etc/prometheus/rules/*.yml"],
+                OUTPUT_CONFIG,
+            )
+
+            python_dump, python_time = timed(yaml.safe_dump, config)
+            libyaml_dump, libyaml_time = timed(serialization.dump, config)
+            assert python_dump == libyaml_dump
+
+            print(
+                f"{project_count:>8} {len(config['scrape_configs']):>7} "
+                + f"{len(libyaml_dump) / 2**20:>10.2f} {render_time:>10.3f} "
+                + f"{python_time:>15.3f} {libyaml_time:>16.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Compare the size and parse time of prometheus.yml written with and without
+YAML anchors and aliases for repeated structures.
+
+Parse times are measured with the libyaml based loader, which is only a proxy
+for the Go YAML library Prometheus uses. Fleets large enough for go-yaml to
+refuse the aliased config are dumped without aliases.
+
+Run with: python -m benchmarks.yaml_aliases
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fleet import FakeManager, create_main_config, generate_fleet
+from prometheus_configurator import serialization
+from prometheus_configurator.manager import PrometheusManagerClient
+from prometheus_configurator.prometheus import ConfigFileCreator
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--projects", type=int, nargs="+", default=[100, 1000, 5000, 10000]
+    )
+    parser.add_argument(
+        "--openstack-discovery-mode",
+        choices=["project_name", "all_tenants"],
+        default="project_name",
+    )
+    args = parser.parse_args()
+
+    output_config = {
+        "blackbox_address": "localhost:9115",
+        "fqdn_template": "{instance}.{project}.example.org",
+        "openstack_discovery_mode": args.openstack_discovery_mode,
+    }
+
+    print(
+        f"{'projects':>8} {'mode':>7} {'size (MiB)':>10} "
+        + f"{'dump (s)':>9} {'parse (s)':>9}"
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        creator = ConfigFileCreator(create_main_config(Path(temp_dir)))
+
+        for project_count in args.projects:
+            fleet = generate_fleet(project_count)
+            with FakeManager(fleet) as manager:
+                snapshot = ManagerSnapshot.fetch(PrometheusManagerClient(manager.url))
+
+            config, _ = creator.create_prometheus_config(
+                snapshot.projects,
+                snapshot,
+                ["/etc/prometheus/rules/*.yml"],
+                output_config,
+            )
+
+            plain, plain_dump_time = timed(serialization.dump, config)
+            aliased, aliased_dump_time = timed(
+                serialization.dump_with_aliases,
+                config,
+                [creator.openstack_credentials],
+            )
+
+            _, plain_parse_time = timed(serialization.load, plain)
+            _, aliased_parse_time = timed(serialization.load, aliased)
+
+            for mode, content, dump_time, parse_time in [
+                ("plain", plain, plain_dump_time, plain_parse_time),
+                ("aliases", aliased, aliased_dump_time, aliased_parse_time),
+            ]:
+                print(
+                    f"{project_count:>8} {mode:>7} {len(content) / 2**20:>10.2f} "
+                    + f"{dump_time:>9.3f} {parse_time:>9.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
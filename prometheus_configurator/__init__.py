@@ -3,14 +3,16 @@
 
 from __future__ import annotations
 
+from typing import Optional
+
 from pkg_resources import DistributionNotFound, get_distribution  # type: ignore
 
-from prometheus_configurator.manager import PrometheusManagerClient
 from prometheus_configurator.outputs import Output
 from prometheus_configurator.outputs.alertmanager import AlertmanagerOutput
 from prometheus_configurator.outputs.karma_acl import KarmaAclOutput
 from prometheus_configurator.outputs.prometheus import PrometheusOutput
 from prometheus_configurator.outputs.thanos_rule import ThanosRuleOutput
+from prometheus_configurator.reload import ReloadCoordinator
 
 try:
     __version__: str = get_distribution("prometheus_configurator").version
@@ -19,15 +21,17 @@ except DistributionNotFound:
 
 
 def create_output(
-    output_config: dict, main_config: dict, manager_client: PrometheusManagerClient
+    output_config: dict,
+    main_config: dict,
+    reloader: Optional[ReloadCoordinator] = None,
 ) -> Output:
     kind = output_config.get("kind")
     if kind == "prometheus":
-        return PrometheusOutput(output_config, main_config, manager_client)
+        return PrometheusOutput(output_config, main_config, reloader)
     if kind == "alertmanager":
-        return AlertmanagerOutput(output_config, main_config, manager_client)
+        return AlertmanagerOutput(output_config, main_config, reloader)
     if kind == "karma_acl":
-        return KarmaAclOutput(output_config, main_config, manager_client)
+        return KarmaAclOutput(output_config, main_config, reloader)
     if kind == "thanos_rule":
-        return ThanosRuleOutput(output_config, main_config, manager_client)
+        return ThanosRuleOutput(output_config, main_config, reloader)
     raise NotImplementedError(f"Output {kind} is not supported.")
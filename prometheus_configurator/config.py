@@ -7,8 +7,7 @@ import logging
 from pathlib import Path
 from typing import Any
 
-import yaml
-
+from prometheus_configurator import serialization
 from prometheus_configurator.utils import merge
 
 logger = logging.getLogger(__name__)
@@ -18,6 +17,6 @@ def load_config_files(paths: list[Path]) -> dict[str, Any]:
     data: dict[str, Any] = {}
     for path in paths:
         logger.info(f"loading own configuration from {path}")
-        data = merge(yaml.safe_load(path.open(mode="r")), data)
+        data = merge(serialization.load(path.open(mode="r")), data)
 
     return data
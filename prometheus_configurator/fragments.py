@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import prometheus_configurator
+from prometheus_configurator.utils import content_hash, write_atomically
+
+logger = logging.getLogger(__name__)
+
+# Part of every fragment key. Increase this whenever a change alters how
+# fragments are rendered, so that fragments cached by older code are not used.
+FRAGMENT_FORMAT_VERSION = 2
+
+
+class FragmentCache:
+    """Stores rendered per-project config fragments keyed by their inputs."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._used: set[str] = set()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _load(self, key: str) -> Optional[Any]:
+        try:
+            with self._path(key).open(mode="r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning(f"ignoring corrupted fragment {self._path(key)}")
+            return None
+
+    def get_or_create(self, inputs: Any, create: Callable[[], Any]) -> Any:
+        key = content_hash(
+            {
+                "format": FRAGMENT_FORMAT_VERSION,
+                "version": prometheus_configurator.__version__,
+                "inputs": inputs,
+            }
+        )
+        self._used.add(key)
+
+        fragment = self._load(key)
+        if fragment is not None:
+            self.hits += 1
+            return fragment
+
+        self.misses += 1
+        fragment = create()
+        write_atomically(self._path(key), json.dumps(fragment))
+        return fragment
+
+    def prune(self):
+        """Remove every fragment that was not used since this cache was created."""
+        for path in self.directory.glob("*.json"):
+            if path.stem not in self._used:
+                path.unlink()
+
+        logger.info(
+            f"fragment cache {self.directory}: {self.hits} hits, {self.misses} misses"
+        )
@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from prometheus_configurator.utils import write_atomically
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    url: str
+    body: Any
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Stores the last successful response for each manager URL on disk."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def load(self, url: str) -> Optional[CachedResponse]:
+        path = self._path(url)
+        try:
+            with path.open(mode="r") as file:
+                return CachedResponse(**json.load(file))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError):
+            logger.warning(f"ignoring corrupted http cache entry {path}")
+            return None
+
+    def store(self, response: CachedResponse):
+        write_atomically(self._path(response.url), json.dumps(asdict(response)))
+
+    def delete(self, url: str):
+        self._path(url).unlink(missing_ok=True)
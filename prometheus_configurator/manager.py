@@ -3,40 +3,399 @@
 
 from __future__ import annotations
 
-import functools
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Optional
 
 import requests
 
 import prometheus_configurator
+from prometheus_configurator import metrics
+from prometheus_configurator.http_cache import CachedResponse, ResponseCache
+from prometheus_configurator.utils import write_atomically
 
 logger = logging.getLogger(__name__)
 
+# Resources whose changes are listed in the manager change feed, in addition
+# to the details of individual projects
+CHANGE_FEED_COLLECTIONS = (
+    "projects",
+    "contact-groups",
+    "supported-openstack-images",
+    "global-alerts",
+)
+CHANGE_FEED_CURSOR_FILE = "changes-cursor"
+
+
+def _is_project_details_list(data: Any) -> bool:
+    """Whether a response lists full project details, not just summaries."""
+    return isinstance(data, list) and all("alert_rules" in project for project in data)
+
 
 class PrometheusManagerClient:
-    def __init__(self, base_url: str):
+    def __init__(
+        self,
+        base_url: str,
+        max_workers: int = 8,
+        bulk_chunk_size: int = 100,
+        cache: Optional[ResponseCache] = None,
+        timeout: Optional[float] = None,
+        serve_stale: bool = True,
+        cache_ttl: Optional[float] = None,
+        change_feed: bool = False,
+    ):
         self.base_url = base_url
+        self.max_workers = max_workers
+        self.bulk_chunk_size = bulk_chunk_size
+        self.cache = cache
+        self.timeout = timeout
+        self.serve_stale = serve_stale
+        self.cache_ttl = cache_ttl
+        self.change_feed = change_feed
         self.session = requests.Session()
+        # Let every prefetch worker keep its own connection open
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(max_workers, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.session.headers["User-Agent"] = (
             f"prometheus_configurator/{prometheus_configurator.__version__} "
             + f"python-requests/{requests.__version__}"
         )
 
-    def get(self, url, **kwargs):
-        url = f"{self.base_url}/{url.lstrip('/')}"
+        # project id -> (time.monotonic() when fetched, details)
+        self._project_details: dict[int, tuple[float, Any]] = {}
+        self._project_details_lock = threading.Lock()
+        # None until the first bulk request tells us whether the manager supports it
+        self._bulk_supported: Optional[bool] = None
+
+        # Position in the manager change feed, persisted in the cache directory
+        # if there is one
+        self._changes_cursor: Optional[str] = None
+        # Whether everything cached is known to be up to date for this run,
+        # except for what the change feed said has changed
+        self._changes_synced = False
+        self._warned_no_changes = False
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
         logger.debug(f"performing http GET request to {url}")
-        return self.session.get(url, **kwargs).json()
+        # Label by the path with ids removed to keep the number of series bounded
+        endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", url[len(self.base_url) :])
+
+        start = time.monotonic()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            metrics.MANAGER_REQUESTS.inc(endpoint=endpoint, status="error")
+            raise
+        finally:
+            metrics.MANAGER_REQUEST_DURATION.observe(
+                time.monotonic() - start, endpoint=endpoint
+            )
+
+        metrics.MANAGER_REQUESTS.inc(
+            endpoint=endpoint, status=str(response.status_code)
+        )
+        return response
+
+    def _cache_key(self, path: str, params: Optional[dict[str, Any]] = None) -> str:
+        # Include the query string in the cache key
+        request = requests.Request("GET", f"{self.base_url}{path}", params=params)
+        return str(request.prepare().url)
+
+    def _is_tracked(self, path: str, kwargs: dict[str, Any]) -> bool:
+        """Whether the change feed lists the changes to this resource."""
+        return not kwargs.get("params") and (
+            path in [f"/v1/{name}" for name in CHANGE_FEED_COLLECTIONS]
+            or re.fullmatch(r"/v1/projects/\d+", path) is not None
+        )
+
+    def _count_project_details(
+        self, path: str, kwargs: dict[str, Any], body: Any, result: str
+    ):
+        """Count the project details in a response by where they came from."""
+        if re.fullmatch(r"/v1/projects/\d+", path):
+            metrics.PROJECT_DETAILS_CACHE.inc(result=result)
+        elif (
+            path == "/v1/projects"
+            and (kwargs.get("params") or {}).get("expand") == "details"
+            and _is_project_details_list(body)
+        ):
+            metrics.PROJECT_DETAILS_CACHE.inc(len(body), result=result)
+
+    def _request(self, url, **kwargs) -> tuple[int, Any]:
+        path = f"/{url.lstrip('/')}"
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+
+        if self.cache is None or path == "/v1/changes":
+            response = self._get(url, **kwargs)
+            if response.status_code != 200:
+                # Error responses, for example of older managers for endpoints
+                # they do not have, are not necessarily JSON
+                return response.status_code, None
+            body = response.json()
+            self._count_project_details(path, kwargs, body, "miss")
+            return response.status_code, body
+
+        cache_key = self._cache_key(path, kwargs.get("params"))
+        cached = self.cache.load(cache_key)
+        if cached and self._changes_synced and self._is_tracked(path, kwargs):
+            # The change feed says this has not changed
+            self._count_project_details(path, kwargs, cached.body, "hit")
+            return 200, cached.body
+
+        if cached:
+            kwargs["headers"] = {
+                **cached.conditional_headers(),
+                **kwargs.get("headers", {}),
+            }
+
+        try:
+            response = self._get(url, **kwargs)
+        except requests.RequestException as e:
+            if cached and self.serve_stale:
+                logger.warning(f"serving cached data for {cached.url}: {e}")
+                self._count_project_details(path, kwargs, cached.body, "hit")
+                return 200, cached.body
+            raise
+
+        if response.status_code == 304 and cached:
+            self._count_project_details(path, kwargs, cached.body, "hit")
+            return 200, cached.body
+        if response.status_code >= 500 and cached and self.serve_stale:
+            logger.warning(
+                f"serving cached data for {cached.url}: "
+                + f"got http status {response.status_code}"
+            )
+            self._count_project_details(path, kwargs, cached.body, "hit")
+            return 200, cached.body
+
+        if response.status_code != 200:
+            return response.status_code, None
+
+        body = response.json()
+        self.cache.store(
+            CachedResponse(
+                url=cache_key,
+                body=body,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        )
+        self._count_project_details(path, kwargs, body, "miss")
+        return response.status_code, body
+
+    def get(self, url, **kwargs):
+        status, body = self._request(url, **kwargs)
+        if status != 200:
+            raise requests.HTTPError(f"got http status {status} for {url}")
+        return body
 
     def get_projects(self):
-        # TODO: shard projects across multiple prometheus instances? see T286301
         return self.get("/v1/projects")
 
-    @functools.lru_cache(maxsize=1024)
+    def _is_fresh(self, fetched_at: float) -> bool:
+        if self._changes_synced:
+            # Changed projects were already dropped by sync_changes()
+            return True
+        return self.cache_ttl is None or time.monotonic() - fetched_at < self.cache_ttl
+
+    def _load_changes_cursor(self) -> Optional[str]:
+        if self._changes_cursor is None and self.cache:
+            try:
+                path = self.cache.directory / CHANGE_FEED_CURSOR_FILE
+                self._changes_cursor = path.read_text().strip() or None
+            except FileNotFoundError:
+                pass
+        return self._changes_cursor
+
+    def _store_changes_cursor(self, cursor: str):
+        self._changes_cursor = cursor
+        if self.cache:
+            write_atomically(self.cache.directory / CHANGE_FEED_CURSOR_FILE, cursor)
+
+    def _fetch_changes(self, cursor: Optional[str]) -> tuple[int, Any]:
+        return self._request(
+            "/v1/changes", params={"since": cursor} if cursor is not None else None
+        )
+
+    def sync_changes(self):
+        """Ask the manager what has changed since the previous run.
+
+        Anything cached that did not change is then used without asking the
+        manager again. If the manager has no change feed, everything is
+        refreshed like without one."""
+        self._changes_synced = False
+        if not self.change_feed:
+            return
+
+        cursor = self._load_changes_cursor()
+        try:
+            status, data = self._fetch_changes(cursor)
+            if status == 410:
+                logger.info("change feed cursor expired, refreshing everything")
+                cursor = None
+                status, data = self._fetch_changes(None)
+        except requests.RequestException as e:
+            logger.warning(f"failed to fetch manager changes: {e}")
+            return
+
+        if status == 404:
+            # Keep asking, in case the manager gets upgraded
+            if not self._warned_no_changes:
+                logger.info("manager does not have a change feed")
+                self._warned_no_changes = True
+            return
+        if status != 200:
+            logger.warning(f"failed to fetch manager changes: got http status {status}")
+            return
+
+        if cursor is None:
+            # Nothing is known about what changed before the new cursor. The
+            # refresh after this will pick it all up, and anything changed
+            # during it is listed again by the next sync.
+            with self._project_details_lock:
+                self._project_details.clear()
+            self._store_changes_cursor(data["cursor"])
+            logger.info(f"following the manager change feed from {data['cursor']}")
+            return
+
+        changed_urls = [f"/v1/projects/{project_id}" for project_id in data["projects"]]
+        changed_urls.extend(f"/v1/{name}" for name in data["collections"])
+        # Drop everything that changed before storing the new cursor, so that
+        # a failure in between can not make us miss a change
+        with self._project_details_lock:
+            for project_id in data["projects"]:
+                self._project_details.pop(project_id, None)
+        if self.cache:
+            for url in changed_urls:
+                self.cache.delete(self._cache_key(url))
+        self._store_changes_cursor(data["cursor"])
+
+        self._changes_synced = True
+        logger.info(
+            f"manager change feed lists {len(data['projects'])} changed projects "
+            + f"and {len(data['collections'])} changed collections"
+        )
+
     def get_project_details(self, project_id: int):
-        return self.get(f"/v1/projects/{project_id}")
+        with self._project_details_lock:
+            if project_id in self._project_details:
+                fetched_at, details = self._project_details[project_id]
+                if self._is_fresh(fetched_at):
+                    return details
+
+        details = self.get(f"/v1/projects/{project_id}")
+        with self._project_details_lock:
+            self._project_details[project_id] = (time.monotonic(), details)
+        return details
+
+    def _get_project_details_bulk(
+        self, project_ids: list[int]
+    ) -> Optional[dict[int, Any]]:
+        status, data = self._request(
+            "/v1/projects", params={"expand": "details", "id": project_ids}
+        )
+        if status != 200:
+            return None
+
+        # Older managers ignore the unknown parameters and return the summaries
+        if not _is_project_details_list(data):
+            return None
+
+        return {project["id"]: project for project in data}
+
+    def _prefetch_bulk(self, executor: ThreadPoolExecutor, project_ids: list[int]):
+        chunks = [
+            project_ids[i : i + self.bulk_chunk_size]
+            for i in range(0, len(project_ids), self.bulk_chunk_size)
+        ]
+
+        results: list[Optional[dict[int, Any]]] = []
+        if self._bulk_supported is None:
+            # Probe with the first chunk so that unsupported managers only
+            # get a single wasted request
+            first = self._get_project_details_bulk(chunks[0])
+            self._bulk_supported = first is not None
+            if first is None:
+                logger.info(
+                    "manager does not support bulk project details, "
+                    + "falling back to per-project requests"
+                )
+                return
+            results.append(first)
+            chunks = chunks[1:]
+
+        results.extend(executor.map(self._get_project_details_bulk, chunks))
+
+        now = time.monotonic()
+        with self._project_details_lock:
+            for result in results:
+                if result is not None:
+                    for project_id, details in result.items():
+                        self._project_details[project_id] = (now, details)
+
+        if self.change_feed and self.cache:
+            # Keep the details where later runs look for unchanged projects
+            for result in results:
+                for project_id, details in (result or {}).items():
+                    self.cache.store(
+                        CachedResponse(
+                            url=self._cache_key(f"/v1/projects/{project_id}"),
+                            body=details,
+                        )
+                    )
+
+    def _load_cached_project_details(self, project_ids: list[int]):
+        assert self.cache
+        now = time.monotonic()
+        for project_id in project_ids:
+            cached = self.cache.load(self._cache_key(f"/v1/projects/{project_id}"))
+            if cached:
+                metrics.PROJECT_DETAILS_CACHE.inc(result="hit")
+                with self._project_details_lock:
+                    self._project_details[project_id] = (now, cached.body)
+
+    def prefetch_project_details(self, project_ids: Iterable[int]):
+        def find_missing(ids: Iterable[int]) -> list[int]:
+            with self._project_details_lock:
+                return [
+                    project_id
+                    for project_id in dict.fromkeys(ids)
+                    if project_id not in self._project_details
+                    or not self._is_fresh(self._project_details[project_id][0])
+                ]
+
+        missing = find_missing(project_ids)
+        if missing and self._changes_synced and self.cache:
+            # Projects that have not changed since a previous run
+            self._load_cached_project_details(missing)
+            missing = find_missing(missing)
+        if not missing:
+            return
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if self.bulk_chunk_size > 0 and self._bulk_supported is not False:
+                self._prefetch_bulk(executor, missing)
+
+            # Anything the bulk requests did not return is fetched one by one;
+            # list() to re-raise any exceptions from the workers
+            list(executor.map(self.get_project_details, find_missing(missing)))
+
+        logger.info(
+            f"fetched details for {len(missing)} projects in "
+            + f"{time.monotonic() - start:.2f}s using {self.max_workers} workers"
+        )
 
     def get_contact_groups(self):
         return self.get("/v1/contact-groups")
 
     def get_supported_openstack_images(self):
         return self.get("/v1/supported-openstack-images")
+
+    def get_global_alerts(self):
+        return self.get("/v1/global-alerts")
@@ -0,0 +1,286 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import fcntl
+import filecmp
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Callable, Iterable
+
+from prometheus_configurator import metrics
+from prometheus_configurator.utils import create_temporary_file, write_atomically
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsWrite
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".prometheus-configurator-manifest.json"
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    sha256: str
+    size: int
+    mtime_ns: int
+
+
+class _HashingWriter:
+    """Encodes and writes text to a binary file, hashing it on the way."""
+
+    def __init__(self, file: IO[bytes]):
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        data = text.encode()
+        self.hash.update(data)
+        self.size += len(data)
+        self.file.write(data)
+        return len(text)
+
+
+def _write_temporary_file(
+    path: Path, write: Callable[[SupportsWrite[str]], None]
+) -> tuple[str, _HashingWriter]:
+    """Write the content produced by a callback into a temporary file next
+    to path, to be renamed over it or deleted by the caller."""
+    fd, temp_name = create_temporary_file(path)
+    try:
+        with os.fdopen(fd, mode="wb") as file:
+            writer = _HashingWriter(file)
+            write(writer)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+    return temp_name, writer
+
+
+def write_file(path: Path, content: str) -> bool:
+    """Write a single file atomically unless it already has this content.
+
+    Unlike with Manifest, the current content is always read back, to not
+    leave any state next to files in directories we do not own. Returns
+    whether the file was written."""
+    metrics.FILES_EXAMINED.inc()
+
+    data = content.encode()
+    try:
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+
+    write_atomically(path, content)
+    metrics.FILES_WRITTEN.inc()
+    metrics.BYTES_WRITTEN.inc(len(data))
+    return True
+
+
+def write_file_streaming(
+    path: Path, write: Callable[[SupportsWrite[str]], None]
+) -> bool:
+    """Like write_file(), but with the content written by a callback."""
+    metrics.FILES_EXAMINED.inc()
+
+    temp_name, writer = _write_temporary_file(path, write)
+    try:
+        if (
+            path.exists()
+            and path.stat().st_size == writer.size
+            and filecmp.cmp(path, temp_name, shallow=False)
+        ):
+            os.unlink(temp_name)
+            return False
+
+        os.replace(temp_name, path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+    metrics.FILES_WRITTEN.inc()
+    metrics.BYTES_WRITTEN.inc(writer.size)
+    return True
+
+
+class Manifest:
+    """Records the files generated into a directory owned by an output.
+
+    Files whose recorded hash matches the new content are not opened at all,
+    as long as their size and mtime show that nobody has touched them since.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.entries = self._load()
+
+        self._written: dict[str, ManifestEntry] = {}
+        self._removed: set[str] = set()
+        self._generated: set[str] = set()
+        # Files that are not in the manifest, but should be deleted if stale
+        self._adopted: set[str] = set()
+
+    @property
+    def _path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    @property
+    def exists(self) -> bool:
+        return self._path.exists()
+
+    def adopt(self, names: Iterable[str]):
+        """Treat files as generated by us, for example ones written before
+        there was a manifest, so that they are deleted once stale."""
+        self._adopted.update(name for name in names if name not in self.entries)
+
+    def _load(self) -> dict[str, ManifestEntry]:
+        try:
+            with self._path.open(mode="r") as file:
+                return {
+                    name: ManifestEntry(**entry)
+                    for name, entry in json.load(file).items()
+                }
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError):
+            logger.warning(f"ignoring corrupted manifest {self._path}")
+            return {}
+
+    def _is_unchanged(
+        self,
+        name: str,
+        digest: str,
+        size: int,
+        has_content: Callable[[Path], bool],
+    ) -> bool:
+        path = self.directory / name
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+
+        entry = self.entries.get(name)
+        if entry is None:
+            # Not generated by a version that kept a manifest, compare the
+            # contents once so that upgrading does not rewrite everything
+            return stat.st_size == size and has_content(path)
+
+        return (
+            entry.sha256 == digest
+            and entry.size == stat.st_size
+            and entry.mtime_ns == stat.st_mtime_ns
+        )
+
+    def _record(self, name: str, digest: str):
+        stat = (self.directory / name).stat()
+        entry = ManifestEntry(
+            sha256=digest, size=stat.st_size, mtime_ns=stat.st_mtime_ns
+        )
+        self.entries[name] = entry
+        self._written[name] = entry
+
+    def write_file(self, name: str, content: str) -> bool:
+        """Write a file atomically unless it is already up to date.
+
+        Returns whether the file was written."""
+        self._generated.add(name)
+        metrics.FILES_EXAMINED.inc()
+
+        data = content.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        if self._is_unchanged(
+            name, digest, len(data), lambda path: path.read_bytes() == data
+        ):
+            if name not in self.entries:
+                self._record(name, digest)
+            return False
+
+        write_atomically(self.directory / name, content)
+        self._record(name, digest)
+        metrics.FILES_WRITTEN.inc()
+        metrics.BYTES_WRITTEN.inc(len(data))
+        return True
+
+    def write_file_streaming(
+        self, name: str, write: Callable[[SupportsWrite[str]], None]
+    ) -> bool:
+        """Like write_file(), but with the content written by a callback.
+
+        The content goes straight into a temporary file and is hashed on the
+        way, so that it never needs to be in memory all at once. Returns
+        whether the file was replaced."""
+        self._generated.add(name)
+        metrics.FILES_EXAMINED.inc()
+
+        temp_name, writer = _write_temporary_file(self.directory / name, write)
+        try:
+            digest = writer.hash.hexdigest()
+            if self._is_unchanged(
+                name,
+                digest,
+                writer.size,
+                lambda path: filecmp.cmp(path, temp_name, shallow=False),
+            ):
+                os.unlink(temp_name)
+                if name not in self.entries:
+                    self._record(name, digest)
+                return False
+
+            os.replace(temp_name, self.directory / name)
+        except BaseException:
+            # The temporary file is gone if it was already renamed or unlinked
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+
+        self._record(name, digest)
+        metrics.FILES_WRITTEN.inc()
+        metrics.BYTES_WRITTEN.inc(writer.size)
+        return True
+
+    def remove_stale(self) -> list[str]:
+        """Delete recorded files that were not generated by this instance."""
+        removed = []
+        for name in [*self.entries.keys(), *sorted(self._adopted)]:
+            if name in self._generated or name in removed:
+                continue
+
+            (self.directory / name).unlink(missing_ok=True)
+            self.entries.pop(name, None)
+            self._removed.add(name)
+            metrics.FILES_DELETED.inc()
+            removed.append(name)
+
+        return removed
+
+    def save(self):
+        if not self._written and not self._removed:
+            return
+
+        # Several outputs may share a directory, so merge our changes with
+        # what is on disk instead of overwriting it with our view
+        with (self.directory / f"{MANIFEST_NAME}.lock").open(mode="w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = self._load()
+            entries.update(self._written)
+            for name in self._removed:
+                entries.pop(name, None)
+
+            write_atomically(
+                self._path,
+                json.dumps(
+                    {name: asdict(entry) for name, entry in sorted(entries.items())},
+                    indent=1,
+                ),
+            )
+
+        self.entries = entries
+        self._written = {}
+        self._removed = set()
@@ -0,0 +1,228 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Metrics about the configurator itself, written in the Prometheus text format
+for the node-exporter textfile collector.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from prometheus_configurator.utils import write_atomically
+
+Labels = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, registry: Registry):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, registry: Registry):
+        super().__init__(name, documentation, registry)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        registry: Registry,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, registry)
+        self.buckets = (*buckets, math.inf)
+        # labels -> (count per bucket, sum of observed values)
+        self._values: dict[Labels, tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total))
+                for labels, (counts, total) in self._values.items()
+            )
+        for labels, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                le = (("le", _format_value(bound)),)
+                yield f"{self.name}_bucket{_format_labels(labels, le)} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {counts[-1]}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            samples = list(metric.samples())
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path):
+        # The textfile collector must never see a partially written file
+        write_atomically(path, self.render())
+
+
+REGISTRY = Registry()
+
+RUN_DURATION = Gauge(
+    "prometheus_configurator_run_duration_seconds",
+    "Duration of the last run",
+    REGISTRY,
+)
+RUN_TIMESTAMP = Gauge(
+    "prometheus_configurator_run_timestamp_seconds",
+    "Time the last run finished",
+    REGISTRY,
+)
+RUN_SUCCESS = Gauge(
+    "prometheus_configurator_run_success",
+    "Whether the last run finished without errors",
+    REGISTRY,
+)
+PHASE_DURATION = Gauge(
+    "prometheus_configurator_phase_duration_seconds",
+    "Duration of each phase of the last run",
+    REGISTRY,
+)
+OUTPUT_DURATION = Gauge(
+    "prometheus_configurator_output_duration_seconds",
+    "Duration of writing each output in the last run",
+    REGISTRY,
+)
+
+MANAGER_REQUESTS = Counter(
+    "prometheus_configurator_manager_requests_total",
+    "Requests made to the manager API",
+    REGISTRY,
+)
+MANAGER_REQUEST_DURATION = Histogram(
+    "prometheus_configurator_manager_request_duration_seconds",
+    "Latency of requests made to the manager API",
+    REGISTRY,
+)
+PROJECT_DETAILS_CACHE = Counter(
+    "prometheus_configurator_project_details_cache_total",
+    "Project details answered from the HTTP cache (hit) or by the manager (miss)",
+    REGISTRY,
+)
+
+FILES_EXAMINED = Counter(
+    "prometheus_configurator_files_examined_total",
+    "Generated files compared with their previous version",
+    REGISTRY,
+)
+FILES_WRITTEN = Counter(
+    "prometheus_configurator_files_written_total",
+    "Generated files that were written",
+    REGISTRY,
+)
+FILES_DELETED = Counter(
+    "prometheus_configurator_files_deleted_total",
+    "Stale generated files that were deleted",
+    REGISTRY,
+)
+BYTES_WRITTEN = Counter(
+    "prometheus_configurator_written_bytes_total",
+    "Bytes written to generated files",
+    REGISTRY,
+)
+
+RELOADS = Counter(
+    "prometheus_configurator_reloads_total",
+    "Reload actions performed",
+    REGISTRY,
+)
+
+SCRAPE_JOBS = Gauge(
+    "prometheus_configurator_scrape_jobs",
+    "Scrape jobs in the last generated Prometheus configuration",
+    REGISTRY,
+)
+SCRAPE_TARGETS = Gauge(
+    "prometheus_configurator_static_scrape_targets",
+    "Statically configured targets in the last generated Prometheus configuration",
+    REGISTRY,
+)
+RULES = Gauge(
+    "prometheus_configurator_rules",
+    "Rules in the last generated rule files",
+    REGISTRY,
+)
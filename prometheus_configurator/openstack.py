@@ -5,21 +5,21 @@ from __future__ import annotations
 
 import logging
 
-import yaml
+from prometheus_configurator import serialization
 
 logger = logging.getLogger(__name__)
 
 
-def read_openstack_configuration(file: str):
+def read_openstack_configuration(file: str, refresh_interval: str = "5m"):
     logger.debug(f"loading openstack config from file {file}")
     with open(file, "r") as openstack_file:
-        data = yaml.safe_load(openstack_file)
+        data = serialization.load(openstack_file)
         return {
             "all_tenants": False,
             "domain_id": data["OS_PROJECT_DOMAIN_ID"],
             "identity_endpoint": data["OS_AUTH_URL"],
             "password": data["OS_PASSWORD"],
-            "refresh_interval": "5m",
+            "refresh_interval": refresh_interval,
             "region": data["OS_REGION_NAME"],
             "username": data["OS_USERNAME"],
         }
@@ -4,37 +4,65 @@
 from __future__ import annotations
 
 import logging
-import subprocess
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
 
-from prometheus_configurator.manager import PrometheusManagerClient
+from prometheus_configurator import manifest
+from prometheus_configurator.reload import ReloadCoordinator
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsWrite
 
 logger = logging.getLogger(__name__)
 
 
 class Output:
+    # ManagerSnapshot fields this output is rendered from
+    inputs: tuple[str, ...] = (
+        "projects",
+        "project_details",
+        "contact_groups",
+        "supported_openstack_images",
+        "global_alerts",
+    )
+
     def __init__(
-        self, config: dict, main_config: dict, manager: PrometheusManagerClient
+        self,
+        config: dict,
+        main_config: dict,
+        reloader: Optional[ReloadCoordinator] = None,
     ):
         self.config = config
         self.main_config = main_config
-        self.manager = manager
+        # Reloads are only registered here, the caller must execute them
+        self.reloader = reloader or ReloadCoordinator()
 
-    def write(self, projects: list):
+    def write(self, snapshot: ManagerSnapshot):
         pass
 
+    def input_files(self) -> list[Path]:
+        """Files besides the configuration that this output is rendered from."""
+        return []
+
+    def _write_file(self, path: Path, content: str) -> bool:
+        return manifest.write_file(path, content)
+
+    def _write_file_streaming(
+        self, path: Path, write: Callable[[SupportsWrite[str]], None]
+    ) -> bool:
+        return manifest.write_file_streaming(path, write)
+
     def _get_project_config(self, project: str) -> dict:
         return self.main_config.get("projects", {}).get(project, {})
 
     def _reload_units(self):
-        # This will succeed even if Prometheus fails to reload its config
-        # In that case, just let it - it will alert shortly
         for unit in self.config.get("units_to_reload", []):
-            logger.info(f"reloading systemd unit {unit}")
-            subprocess.check_call(
-                ["/usr/bin/sudo", "/usr/bin/systemctl", "reload", unit]
-            )
+            logger.info(f"requesting reload of systemd unit {unit}")
+            self.reloader.reload_unit(unit)
         for unit in self.config.get("units_to_restart", []):
-            logger.info(f"restarting systemd unit {unit}")
-            subprocess.check_call(
-                ["/usr/bin/sudo", "/usr/bin/systemctl", "restart", unit]
-            )
+            logger.info(f"requesting restart of systemd unit {unit}")
+            self.reloader.restart_unit(unit)
+        for url in self.config.get("reload_urls", []):
+            logger.info(f"requesting reload via {url}")
+            self.reloader.reload_url(url)
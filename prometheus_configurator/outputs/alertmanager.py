@@ -7,15 +7,17 @@ import logging
 import pathlib
 from typing import Any, List
 
-import yaml
-
+from prometheus_configurator import serialization
 from prometheus_configurator.outputs import Output
+from prometheus_configurator.snapshot import ManagerSnapshot
 from prometheus_configurator.utils import merge
 
 logger = logging.getLogger(__name__)
 
 
 class AlertmanagerOutput(Output):
+    inputs = ("projects", "project_details", "contact_groups")
+
     def _format_webhook_configs(self, members: List[dict]) -> List[dict]:
         alert_routing_config = self.main_config.get("alert_routing", {})
         irc_base = alert_routing_config.get("irc_base", "http://invalid/")
@@ -56,19 +58,19 @@ class AlertmanagerOutput(Output):
             "webhook_configs": self._format_webhook_configs(members),
         }
 
-    def _get_receivers(self) -> List[dict]:
+    def _get_receivers(self, snapshot: ManagerSnapshot) -> List[dict]:
         return [
             self._format_contact_group(contact_group)
-            for contact_group in self.manager.get_contact_groups()
+            for contact_group in snapshot.contact_groups
         ]
 
-    def _get_project_routes(self, projects: list):
+    def _get_project_routes(self, snapshot: ManagerSnapshot):
         routes = []
 
         # TODO: support for more advanced rules, load them from manager
-        for project in projects:
+        for project in snapshot.projects:
             project_name = project.get("name")
-            project_details = self.manager.get_project_details(project.get("id"))
+            project_details = snapshot.get_project_details(project["id"])
 
             contact_group = project_details.get("default_contact_group", None)
 
@@ -85,7 +87,7 @@ class AlertmanagerOutput(Output):
 
         return routes
 
-    def write(self, projects: list):
+    def write(self, snapshot: ManagerSnapshot):
         am_config = self.main_config.get("alertmanager_config", {})
         am_config = merge(am_config, self.config.get("alertmanager_config", {}))
 
@@ -93,22 +95,17 @@ class AlertmanagerOutput(Output):
             am_config,
             {
                 "route": {
-                    "routes": self._get_project_routes(projects),
+                    "routes": self._get_project_routes(snapshot),
                 },
-                "receivers": self._get_receivers(),
+                "receivers": self._get_receivers(snapshot),
             },
         )
 
         base_directory = pathlib.Path(self.config["base_directory"])
         am_config_path = base_directory.joinpath("alertmanager.yml")
 
-        old_config = am_config_path.read_text() if am_config_path.exists() else ""
-        new_config = yaml.safe_dump(am_config)
-
-        if old_config != new_config:
-            with am_config_path.open(mode="w") as file:
-                logger.info(f"writing alert manager config file {am_config_path}")
-                file.write(new_config)
+        if self._write_file(am_config_path, serialization.dump(am_config)):
+            logger.info(f"wrote alert manager config file {am_config_path}")
             self._reload_units()
         else:
             logger.info("alert manager config is up to date")
@@ -6,20 +6,22 @@ from __future__ import annotations
 import logging
 import pathlib
 
-import yaml
-
+from prometheus_configurator import serialization
 from prometheus_configurator.outputs import Output
+from prometheus_configurator.snapshot import ManagerSnapshot
 
 logger = logging.getLogger(__name__)
 
 
 class KarmaAclOutput(Output):
+    inputs = ("projects", "project_details")
+
     def default_group_for_project(self, project: str) -> str:
         return self.main_config.get("project_group_format", "{project}").format(
             project=project
         )
 
-    def write(self, projects: list):
+    def write(self, snapshot: ManagerSnapshot):
         sudo_projects = self.main_config.get("sudo_projects", [])
 
         rules = [
@@ -35,10 +37,10 @@ class KarmaAclOutput(Output):
             },
         ]
 
-        for project in projects:
-            project_name = project.get("name")
+        for project in snapshot.projects:
+            project_name = project["name"]
 
-            project_details = self.manager.get_project_details(project.get("id"))
+            project_details = snapshot.get_project_details(project["id"])
             group = project_details.get("acl_group", None)
             if group is None:
                 group = self.default_group_for_project(project_name)
@@ -65,13 +67,8 @@ class KarmaAclOutput(Output):
 
         file_path = pathlib.Path(self.config["acl_file_path"])
 
-        old_data = file_path.read_text() if file_path.exists() else ""
-        new_data = yaml.safe_dump({"rules": rules})
-
-        if old_data != new_data:
-            with file_path.open(mode="w") as file:
-                logger.info(f"writing karma acl file {file_path}")
-                file.write(new_data)
+        if self._write_file(file_path, serialization.dump({"rules": rules})):
+            logger.info(f"wrote karma acl file {file_path}")
             self._reload_units()
         else:
             logger.info("karma acl file is up to date")
@@ -6,47 +6,122 @@ from __future__ import annotations
 import logging
 import pathlib
 import shlex
-import subprocess
-from typing import Any
-
-import yaml
+from typing import Any, Iterator
 
+from prometheus_configurator import metrics, serialization
+from prometheus_configurator.fragments import FragmentCache
+from prometheus_configurator.manifest import Manifest
 from prometheus_configurator.outputs import Output
 from prometheus_configurator.prometheus import ConfigFileCreator
+from prometheus_configurator.sharding import Sharding
+from prometheus_configurator.snapshot import ManagerSnapshot
+from prometheus_configurator.utils import content_hash
 
 logger = logging.getLogger(__name__)
 
 
 class PrometheusOutput(Output):
+    inputs = (
+        "projects",
+        "project_details",
+        "supported_openstack_images",
+        "global_alerts",
+    )
+
+    def input_files(self) -> list[pathlib.Path]:
+        files = [pathlib.Path(self.main_config["openstack"]["credentials"])]
+        if "blackbox_base_config" in self.config:
+            files.append(pathlib.Path(self.config["blackbox_base_config"]))
+        return files
+
     def write_directory(
         self, base: pathlib.Path, files: dict[str, Any], external: list[str]
     ) -> bool:
         changes_made = False
+        manifest = Manifest(base)
+        if not manifest.exists:
+            # Files generated before the manifest was introduced
+            manifest.adopt(
+                match.name for match in base.glob("*.yml") if match.name not in external
+            )
 
         for file_name, file_content in files.items():
             file_path = base / file_name
 
-            old_content = file_path.read_text() if file_path.exists() else ""
-            new_content = yaml.safe_dump(file_content)
-
-            if old_content != new_content:
-                with file_path.open(mode="w") as file:
-                    logger.info(f"writing file {file_path}")
-                    file.write(yaml.safe_dump(file_content))
+            if manifest.write_file(file_name, serialization.dump(file_content)):
+                logger.info(f"wrote file {file_path}")
                 changes_made = True
             else:
                 logger.info(f"file {file_path} is up to date")
 
-        for match in base.glob("*.yml"):
-            if match.name not in files.keys() and match.name not in external:
-                match.unlink()
-                logger.info(f"removing old file {match}")
-                changes_made = True
+        for file_name in manifest.remove_stale():
+            logger.info(f"removing old file {base / file_name}")
+            changes_made = True
 
+        manifest.save()
         return changes_made
 
-    def write(self, projects: list):
-        creator = ConfigFileCreator(self.main_config)
+    def write_blackbox_config(self, blackbox_configs: dict[str, Any]):
+        """Write the complete blackbox_exporter config, and reload the
+        exporter if it changed."""
+        config: dict[str, Any] = {"modules": {}}
+        if "blackbox_base_config" in self.config:
+            with open(self.config["blackbox_base_config"]) as file:
+                config = serialization.load(file) or config
+            config.setdefault("modules", {})
+
+        for file_name, blackbox_config in sorted(blackbox_configs.items()):
+            for name, module in blackbox_config["modules"].items():
+                if name in config["modules"]:
+                    # Shared modules are identical in every project using them
+                    if config["modules"][name] != module:
+                        logger.warning(
+                            f"ignoring blackbox module {name} from {file_name}"
+                        )
+                    continue
+                config["modules"][name] = module
+
+        path = pathlib.Path(self.config["blackbox_config_path"])
+        if not self._write_file(path, serialization.dump(config)):
+            logger.info("blackbox configuration up to date")
+            return
+
+        logger.info(f"wrote blackbox config file {path}")
+        for unit in self.config.get("blackbox_units_to_reload", []):
+            logger.info(f"requesting reload of systemd unit {unit}")
+            self.reloader.reload_unit(unit)
+        for url in self.config.get("blackbox_reload_urls", []):
+            logger.info(f"requesting blackbox reload via {url}")
+            self.reloader.reload_url(url)
+
+    def write(self, snapshot: ManagerSnapshot):
+        if self.config.get("blackbox_shared_modules") and (
+            "blackbox_config_path" not in self.config
+        ):
+            # Shared modules would be repeated in many per-project files
+            raise ValueError("blackbox_shared_modules requires blackbox_config_path")
+
+        projects = snapshot.projects
+        if "sharding" in self.config:
+            # See T286301
+            sharding = Sharding(self.config["sharding"])
+            sharding.log_report(
+                projects,
+                snapshot.get_project_details,
+                self.main_config.get("global_jobs", []),
+            )
+            projects = sharding.filter_projects(projects)
+
+        fragment_cache = None
+        if "fragment_cache_directory" in self.config:
+            # Each output prunes the fragments it did not use, so outputs
+            # sharing a cache directory (like shards) get their own part of it
+            fragment_cache = FragmentCache(
+                pathlib.Path(self.config["fragment_cache_directory"])
+                / content_hash(self.config["base_directory"])[:16]
+            )
+
+        creator = ConfigFileCreator(self.main_config, fragment_cache)
 
         changes_made = False
 
@@ -58,38 +133,89 @@ class PrometheusOutput(Output):
 
         blackbox_address = self.config.get("blackbox_address")
 
-        config_data, blackbox_scrapes = creator.create_prometheus_config(
-            projects,
-            self.manager,
-            [f"{base_rule_directory}/*.yml"],
-            self.config,
+        config_data, scrape_configs, blackbox_scrapes = (
+            creator.stream_prometheus_config(
+                projects,
+                snapshot,
+                [f"{base_rule_directory}/*.yml"],
+                self.config,
+            )
         )
 
+        job_count = 0
+        target_count = 0
+
+        def count(jobs: Iterator[dict]) -> Iterator[dict]:
+            nonlocal job_count, target_count
+            for job in jobs:
+                job_count += 1
+                target_count += sum(
+                    len(static_config.get("targets", []))
+                    for static_config in job.get("static_configs", [])
+                )
+                yield job
+
         prometheus_config_path = base_directory / "prometheus.yml"
-        old_config = (
-            prometheus_config_path.read_text()
-            if prometheus_config_path.exists()
-            else ""
-        )
-        new_config = yaml.safe_dump(config_data)
-        if old_config != new_config:
-            with prometheus_config_path.open(mode="w") as file:
-                logger.info(f"writing prometheus config file {prometheus_config_path}")
-                file.write(new_config)
+        if self.config.get("yaml_aliases", False):
+            # Aliases can only refer to anchors in the same dump, so this
+            # needs the whole config in memory
+            written = self._write_file(
+                prometheus_config_path,
+                serialization.dump_with_aliases(
+                    {**config_data, "scrape_configs": list(count(scrape_configs))},
+                    merge_bases=[creator.openstack_credentials],
+                ),
+            )
+        else:
+            # Stream the scrape configs, by far the largest part of the file,
+            # straight to disk instead of keeping all of them in memory
+            written = self._write_file_streaming(
+                prometheus_config_path,
+                lambda stream: serialization.dump_streaming(
+                    config_data, "scrape_configs", count(scrape_configs), stream
+                ),
+            )
+
+        if written:
+            logger.info(f"wrote prometheus config file {prometheus_config_path}")
             changes_made = True
         else:
             logger.info("prometheus configuration up to date")
 
-        if blackbox_address:
+        metrics.SCRAPE_JOBS.set(job_count, directory=str(base_directory))
+        metrics.SCRAPE_TARGETS.set(target_count, directory=str(base_directory))
+
+        if blackbox_scrapes:
+            modules = [
+                name
+                for blackbox_config in blackbox_scrapes.values()
+                for name in blackbox_config["modules"]
+            ]
+            logger.info(
+                f"{len(modules)} blackbox modules in {len(blackbox_scrapes)} "
+                + f"projects, {len(set(modules))} of them distinct"
+            )
+
+        if blackbox_address and "blackbox_config_path" in self.config:
+            self.write_blackbox_config(blackbox_scrapes)
+        elif blackbox_address:
             blackbox_directory = pathlib.Path(self.config["blackbox_dir"])
             if self.write_directory(blackbox_directory, blackbox_scrapes, []):
-                logger.info("merging blackbox config")
-                subprocess.check_call(
+                logger.info("requesting blackbox config merge")
+                self.reloader.run_command(
                     ["/usr/bin/sudo", *shlex.split(self.config["blackbox_reload"])]
                 )
                 changes_made = True
 
-        rule_files = creator.create_rule_files(projects, self.manager)
+        rule_files = creator.create_rule_files(projects, snapshot)
+        metrics.RULES.set(
+            sum(
+                len(group["rules"])
+                for rule_file in rule_files.values()
+                for group in rule_file["groups"]
+            ),
+            directory=str(base_directory),
+        )
         if self.write_directory(
             base_rule_directory,
             rule_files,
@@ -97,5 +223,8 @@ class PrometheusOutput(Output):
         ):
             changes_made = True
 
+        if fragment_cache:
+            fragment_cache.prune()
+
         if changes_made:
             self._reload_units()
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Timing spans with optional CPU and memory profiles, for finding out where the
+time of a slow run goes.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+
+@dataclass
+class Span:
+    # Nested spans are named like "outputs/prometheus"
+    name: str
+    duration: float = 0
+    cpu_time: float = 0
+    cpu_profile: Optional[cProfile.Profile] = None
+    peak_memory: Optional[int] = None
+    allocations: list[tracemalloc.StatisticDiff] = field(default_factory=list)
+
+
+class Profiler:
+    """Records a span for each phase and output of a run.
+
+    cProfile and tracemalloc only give meaningful results for one thread at a
+    time, so the caller should not run profiled spans concurrently when either
+    is enabled. CPU profiles do not include threads started within a span.
+    """
+
+    def __init__(self, cpu: bool = False, memory: bool = False, top: int = 15):
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.spans: list[Span] = []
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def exclusive(self) -> bool:
+        return self.cpu or self.memory
+
+    @contextlib.contextmanager
+    def span(self, name: str, detailed: bool = True) -> Iterator[Span]:
+        """Time the enclosed block.
+
+        Spans that contain other detailed spans must set detailed=False, as
+        only one CPU profile can be collected at a time."""
+        span = Span(name=name)
+        self.spans.append(span)
+
+        profile = None
+        if self.cpu and detailed:
+            profile = cProfile.Profile()
+        before = None
+        if self.memory and detailed:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            yield span
+        finally:
+            if profile:
+                profile.disable()
+            span.duration = time.perf_counter() - start
+            span.cpu_time = time.process_time() - cpu_start
+
+            span.cpu_profile = profile
+            if before is not None:
+                _, span.peak_memory = tracemalloc.get_traced_memory()
+                span.allocations = tracemalloc.take_snapshot().compare_to(
+                    before, "lineno"
+                )[: self.top]
+
+    def report(self) -> str:
+        lines = [f"{'span':<40} {'wall (s)':>10} {'cpu (s)':>10} {'peak (MiB)':>10}"]
+        for span in self.spans:
+            peak = f"{span.peak_memory / 2**20:.1f}" if span.peak_memory else "-"
+            indent = "  " * span.name.count("/")
+            lines.append(
+                f"{indent + span.name.rsplit('/', 1)[-1]:<40} {span.duration:>10.3f} "
+                + f"{span.cpu_time:>10.3f} {peak:>10}"
+            )
+
+        if any(span.cpu_profile for span in self.spans):
+            lines.append(
+                "\nCPU hotspots only cover the thread each span ran in. Work done"
+                + " in other threads, like prefetching project details from the"
+                + " manager, only shows up as waiting for them."
+            )
+
+        for span in self.spans:
+            if span.cpu_profile:
+                stream = io.StringIO()
+                stats = pstats.Stats(span.cpu_profile, stream=stream)
+                stats.sort_stats("cumulative").print_stats(self.top)
+                lines.append(f"\n== CPU hotspots in {span.name} ==")
+                lines.append(stream.getvalue().strip())
+            if span.allocations:
+                lines.append(f"\n== allocation sites in {span.name} ==")
+                lines.extend(str(allocation) for allocation in span.allocations)
+
+        return "\n".join(lines)
+
+    def reset(self):
+        self.spans = []
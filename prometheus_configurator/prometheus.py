@@ -3,21 +3,99 @@
 
 from __future__ import annotations
 
+import functools
+import hashlib
+import logging
+import math
 import re
-from typing import Any, Optional
+from typing import Any, Callable, Iterator, Optional
 
-from prometheus_configurator import PrometheusManagerClient, openstack
-from prometheus_configurator.utils import camelcase_projectname
+from prometheus_configurator import openstack
+from prometheus_configurator.fragments import FragmentCache
+from prometheus_configurator.regex import compact_alternation, escape
+from prometheus_configurator.sharding import assign_shard
+from prometheus_configurator.snapshot import ManagerSnapshot
+from prometheus_configurator.utils import camelcase_projectname, content_hash
+
+logger = logging.getLogger(__name__)
+
+SHARED_RECORDING_RULES_FILE = "recording_rules_shared.yml"
+
+# String literals, which must be kept as is
+_PROMQL_STRING = r"(\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*'|`[^`]*`)"
+# String literals or comments, which run until the end of the line
+_PROMQL_STRING_OR_COMMENT = re.compile(_PROMQL_STRING + r"|#[^\n]*")
+# String literals or runs of whitespace
+_PROMQL_STRING_OR_SPACE = re.compile(_PROMQL_STRING + r"|\s+")
+
+
+def estimate_rule_cost(expr: str) -> int:
+    """Very roughly estimate how expensive evaluating a PromQL expression is.
+
+    Range vector selectors and especially subqueries read many samples for
+    each series, so they are weighted more than the rest of the query."""
+    ranges = re.findall(r"\[[^\]]*\]", expr)
+    subqueries = sum(1 for selector in ranges if ":" in selector)
+    return 1 + 2 * (len(ranges) - subqueries) + 5 * subqueries
+
+
+def shared_expression_saving(cost: int, uses: int) -> int:
+    """Estimate how much cheaper sharing an expression between alerts is.
+
+    The expression is evaluated once by the recording rule instead of once
+    per alert, but each alert still selects the recorded series, which is
+    estimated to cost as much as the cheapest expressions. Expressions
+    without range selectors are thus never worth sharing."""
+    return uses * cost - cost - uses
+
+
+def normalize_expr(expr: str) -> str:
+    """Remove the comments and whitespace that do not change the meaning of
+    a PromQL expression, so that otherwise identical expressions compare
+    equal."""
+    # Comments end at a line break, which the whitespace removal below
+    # would otherwise drop
+    expr = _PROMQL_STRING_OR_COMMENT.sub(
+        lambda match: match.group(1) or " ", expr
+    ).strip()
+
+    def replace(match: re.Match) -> str:
+        if match.group(1):
+            return match.group(1)
+        # Whitespace is only needed between two words, like in "a and b"
+        before = expr[match.start() - 1 : match.start()]
+        after = expr[match.end() : match.end() + 1]
+        if re.match(r"\w", before) and re.match(r"\w", after):
+            return " "
+        return ""
+
+    return _PROMQL_STRING_OR_SPACE.sub(replace, expr)
 
 
 class ConfigFileCreator:
-    def __init__(self, params: dict[str, Any]) -> None:
+    def __init__(
+        self, params: dict[str, Any], fragment_cache: Optional[FragmentCache] = None
+    ) -> None:
         self.params = params
-
-        self.openstack_credentials = openstack.read_openstack_configuration(
-            self.params["openstack"]["credentials"]
+        self.fragment_cache = fragment_cache
+
+    @functools.cached_property
+    def openstack_credentials(self) -> dict[str, Any]:
+        # Only needed for scrape configs, not for rule files
+        return openstack.read_openstack_configuration(
+            self.params["openstack"]["credentials"],
+            self.params["openstack"].get("refresh_interval", "5m"),
         )
 
+    @functools.cached_property
+    def all_tenants_project_name(self) -> str:
+        if "all_tenants_project_name" not in self.params["openstack"]:
+            raise ValueError(
+                "the all_tenants OpenStack discovery mode needs "
+                + "openstack.all_tenants_project_name to be set"
+            )
+        return self.params["openstack"]["all_tenants_project_name"]
+
     def _format_blackbox_module(self, config: dict, job: dict) -> dict:
         module = {
             "prober": config["type"],
@@ -50,14 +128,18 @@ class ConfigFileCreator:
             }
 
             if config["headers"]:
-                module["http"]["headers"] = config["headers"]
+                # Copied, as the Host header may be added to it below and the
+                # project details are shared by every output
+                module["http"]["headers"] = dict(config["headers"])
 
             if config["host"]:
                 module["http"]["headers"]["Host"] = config["host"]
                 module["http"]["tls_config"]["server_name"] = config["host"]
 
             if config["valid_status_codes"]:
-                module["http"]["valid_status_codes"] = config["valid_status_codes"]
+                module["http"]["valid_status_codes"] = list(
+                    config["valid_status_codes"]
+                )
 
             if config["require_body_match"]:
                 module["http"]["fail_if_body_not_matches_regexp"] = config[
@@ -71,11 +153,23 @@ class ConfigFileCreator:
 
         return module
 
+    def _blackbox_module_name(
+        self,
+        project_name: str,
+        rule: dict,
+        module: dict,
+        output_config: dict[str, Any],
+    ) -> str:
+        if output_config.get("blackbox_shared_modules", False):
+            # Jobs probing with identical settings share one module
+            return f"module_{content_hash(module)[:16]}"
+        return f"{project_name}_{rule['name']}"
+
     def _create_job(
         self,
         project: dict,
         rule: dict,
-        images: list[str],
+        image_regex: str,
         output_config: dict[str, Any],
     ) -> tuple[Optional[dict], Optional[dict]]:
         project_name = project["name"]
@@ -101,7 +195,6 @@ class ConfigFileCreator:
 
             job["metrics_path"] = "/probe"
             job["scheme"] = "http"
-            job["params"]["module"] = [f"{project_name}_{rule['name']}"]
 
             if "openstack_discovery" not in rule or not rule["openstack_discovery"]:
                 job["relabel_configs"].append(
@@ -119,10 +212,30 @@ class ConfigFileCreator:
             )
 
             blackbox = self._format_blackbox_module(rule["blackbox"], rule)
+            job["params"]["module"] = [
+                self._blackbox_module_name(project_name, rule, blackbox, output_config)
+            ]
 
         if "openstack_discovery" in rule and rule["openstack_discovery"] is not None:
             openstack_config = dict(self.openstack_credentials)
-            openstack_config["project_name"] = project_name
+            if output_config.get("openstack_discovery_mode") == "all_tenants":
+                # Prometheus runs a single discoverer for identical SD configs,
+                # so every job using the same port shares one, and the instances
+                # of other projects are filtered out by relabeling instead.
+                openstack_config["all_tenants"] = True
+                # Listing instances needs a project-scoped token, so scope it
+                # to a project with the rights to list them in every project
+                openstack_config["project_name"] = self.all_tenants_project_name
+                job["relabel_configs"].append(
+                    {
+                        "action": "keep",
+                        "source_labels": ["__meta_openstack_project_id"],
+                        # Cloud VPS project IDs are the same as their names
+                        "regex": escape(project_name),
+                    }
+                )
+            else:
+                openstack_config["project_name"] = project_name
             openstack_config["port"] = rule["openstack_discovery"]["port"]
             openstack_config["role"] = "instance"
 
@@ -132,7 +245,7 @@ class ConfigFileCreator:
                 {
                     "action": "keep",
                     "source_labels": ["__meta_openstack_instance_image"],
-                    "regex": "|".join([re.escape(image) for image in images]),
+                    "regex": image_regex,
                 }
             )
 
@@ -224,50 +337,83 @@ class ConfigFileCreator:
 
         return job, blackbox
 
-    def _create_scrape_configs(
+    def _cached_fragment(self, inputs: Any, create: Callable[[], Any]) -> Any:
+        if self.fragment_cache is None:
+            return create()
+        return self.fragment_cache.get_or_create(inputs, create)
+
+    def _create_project_scrape_configs(
         self,
-        projects: list,
-        manager_client: PrometheusManagerClient,
+        project: dict,
+        project_details: dict,
+        image_regex: str,
         output_config: dict[str, Any],
     ) -> tuple[list, dict[str, Any]]:
         scrape_configs: list[dict] = []
-        blackbox_configs = {}
+        blackbox_modules = {}
+
+        for job in self.params.get("global_jobs", []):
+            job_scrape, _ = self._create_job(project, job, image_regex, output_config)
+            if job_scrape:
+                scrape_configs.append(job_scrape)
+
+        for job in project_details["scrapes"]:
+            job_scrape, job_blackbox = self._create_job(
+                project, job, image_regex, output_config
+            )
+
+            if not job_scrape:
+                continue
+
+            scrape_configs.append(job_scrape)
+            if job_blackbox:
+                blackbox_modules[job_scrape["params"]["module"][0]] = job_blackbox
+
+        return scrape_configs, blackbox_modules
+
+    def _create_scrape_configs(
+        self,
+        projects: list,
+        snapshot: ManagerSnapshot,
+        output_config: dict[str, Any],
+        blackbox_configs: dict[str, Any],
+    ) -> Iterator[dict]:
         images = [
-            image["openstack_id"]
-            for image in manager_client.get_supported_openstack_images()
+            image["openstack_id"] for image in snapshot.supported_openstack_images
         ]
+        # Shared by every OpenStack discovered job
+        image_regex = compact_alternation(images)
+
+        # Everything besides the project itself that the rendered jobs depend on
+        global_inputs = {
+            "global_jobs": self.params.get("global_jobs", []),
+            "images": images,
+            "output_config": output_config,
+            "openstack_credentials": self.openstack_credentials,
+        }
 
         for project in projects:
             project_name = project["name"]
-            project_details = manager_client.get_project_details(project["id"])
-            project_blackbox_modules = {}
-
-            for job in self.params.get("global_jobs", []):
-                job_scrape, _ = self._create_job(project, job, images, output_config)
-                if job_scrape:
-                    scrape_configs.append(job_scrape)
-
-            for job in project_details.get("scrapes"):
-                job_scrape, job_blackbox = self._create_job(
-                    project, job, images, output_config
-                )
+            project_details = snapshot.get_project_details(project["id"])
 
-                if not job_scrape:
-                    continue
-
-                scrape_configs.append(job_scrape)
-                if job_blackbox:
-                    project_blackbox_modules[f"{project_name}_{job['name']}"] = (
-                        job_blackbox
-                    )
+            project_scrape_configs, project_blackbox_modules = self._cached_fragment(
+                {
+                    "kind": "scrape_configs",
+                    "project": project,
+                    "project_details": project_details,
+                    **global_inputs,
+                },
+                lambda: self._create_project_scrape_configs(
+                    project, project_details, image_regex, output_config
+                ),
+            )
+            yield from project_scrape_configs
 
             if project_blackbox_modules:
                 blackbox_configs[f"project_{project_name}.yml"] = {
                     "modules": project_blackbox_modules
                 }
 
-        return scrape_configs, blackbox_configs
-
     def _create_rule(self, rule: dict, name_prefix: str, extra_labels: dict) -> dict:
         return {
             "alert": f"{name_prefix}{rule.get('name')}",
@@ -280,46 +426,107 @@ class ConfigFileCreator:
             },
         }
 
-    def _create_project_rules(self, rules: list, project_name: str) -> dict:
+    def _partition_rules(self, rules: list[dict]) -> list[list[dict]]:
+        """Split rules into groups, which Prometheus evaluates concurrently.
+
+        Alert state is kept per group, so each rule is assigned to a group
+        by its name. Adding or removing rules only moves other rules when the
+        number of groups changes, and then only the ones that now belong to
+        a new group. The limits are met on average, but single groups may
+        be somewhat larger."""
+        config = self.params.get("rule_groups", {})
+        max_rules = config.get("max_rules")
+        max_cost = config.get("max_cost")
+
+        group_count = 1
+        if max_rules:
+            group_count = max(group_count, math.ceil(len(rules) / max_rules))
+        if max_cost:
+            cost = sum(estimate_rule_cost(rule["expr"] or "") for rule in rules)
+            group_count = max(group_count, math.ceil(cost / max_cost))
+
+        groups: list[list[dict]] = [[] for _ in range(group_count)]
+        for rule in rules:
+            name = rule.get("alert") or rule.get("record") or ""
+            groups[assign_shard(name, group_count)].append(rule)
+
+        return groups
+
+    def _create_rule_groups(
+        self,
+        name: str,
+        rules: list[dict],
+        interval: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> list[dict]:
+        config = self.params.get("rule_groups", {})
+        interval = interval or config.get("interval")
+        limit = limit or config.get("limit")
+
+        groups = []
+        partitions = self._partition_rules(rules)
+        for i, group_rules in enumerate(partitions):
+            if not group_rules and len(partitions) > 1:
+                continue
+
+            # Alert state is kept per group name, so the first group keeps the
+            # name used before the rules were split
+            group: dict[str, Any] = {
+                "name": name if i == 0 else f"{name}_{i + 1}",
+                "rules": group_rules,
+            }
+            if interval:
+                group["interval"] = interval
+            if limit:
+                group["limit"] = limit
+            groups.append(group)
+
+        return groups
+
+    def _create_project_rules(
+        self, rules: list, project_name: str, project_details: dict
+    ) -> dict:
         labels = {
             "project": project_name,
         }
 
         return {
-            "groups": [
-                {
-                    "name": project_name,
-                    "rules": [
-                        self._create_rule(
-                            rule, camelcase_projectname(project_name), labels
-                        )
-                        for rule in rules
-                    ],
-                }
-            ]
+            "groups": self._create_rule_groups(
+                project_name,
+                [
+                    self._create_rule(rule, camelcase_projectname(project_name), labels)
+                    for rule in rules
+                ],
+                interval=project_details.get("rule_group_interval"),
+                limit=project_details.get("rule_group_limit"),
+            )
         }
 
     def _create_global_rules(self, rules: list) -> dict:
         return {
-            "groups": [
-                {
-                    "name": "global",
-                    "rules": [self._create_rule(rule, "", {}) for rule in rules],
-                }
-            ]
+            "groups": self._create_rule_groups(
+                "global", [self._create_rule(rule, "", {}) for rule in rules]
+            )
         }
 
-    def create_prometheus_config(
+    def stream_prometheus_config(
         self,
         projects: list,
-        manager_client: PrometheusManagerClient,
+        snapshot: ManagerSnapshot,
         rule_files_paths: list,
         output_config: dict[str, Any],
-    ) -> tuple[dict, dict[str, Any]]:
-        scrape_configs, blackbox_modules = self._create_scrape_configs(
+    ) -> tuple[dict, Iterator[dict], dict[str, Any]]:
+        """Like create_prometheus_config(), but with the scrape configs
+        generated lazily and returned separately from the rest of the config.
+
+        The blackbox configs are only complete once every scrape config has
+        been consumed."""
+        blackbox_configs: dict[str, Any] = {}
+        scrape_configs = self._create_scrape_configs(
             projects,
-            manager_client,
+            snapshot,
             output_config,
+            blackbox_configs,
         )
 
         prometheus_config = {
@@ -342,9 +549,23 @@ class ConfigFileCreator:
                 ],
             },
             "rule_files": rule_files_paths,
-            "scrape_configs": scrape_configs,
         }
 
+        return prometheus_config, scrape_configs, blackbox_configs
+
+    def create_prometheus_config(
+        self,
+        projects: list,
+        snapshot: ManagerSnapshot,
+        rule_files_paths: list,
+        output_config: dict[str, Any],
+    ) -> tuple[dict, dict[str, Any]]:
+        prometheus_config, scrape_configs, blackbox_modules = (
+            self.stream_prometheus_config(
+                projects, snapshot, rule_files_paths, output_config
+            )
+        )
+        prometheus_config["scrape_configs"] = list(scrape_configs)
         return prometheus_config, blackbox_modules
 
     def _create_alert_relabel_configs(
@@ -357,65 +578,149 @@ class ConfigFileCreator:
             }
         ]
 
+        # (label name, label value) -> names of the projects with that label,
+        # in the order the labels first appear in
+        label_projects: dict[tuple[str, str], list[str]] = {}
         for project in projects:
             if not project["extra_labels"]:
                 continue
 
             for label_name, label_value in project["extra_labels"].items():
-                # Add a new label named `label_name` with value `label_value` when the project
-                # label matches the project name. For extra syntax:
-                # https://prometheus.io/docs/prometheus/latest/configuration/configuration/#relabel_config
-                configs.append(
-                    {
-                        "action": "replace",
-                        "source_labels": ["project"],
-                        "regex": project["name"],
-                        "target_label": label_name,
-                        "replacement": label_value,
-                    }
+                label_projects.setdefault((label_name, label_value), []).append(
+                    project["name"]
                 )
 
+        for (label_name, label_value), project_names in label_projects.items():
+            # Add a new label named `label_name` with value `label_value` when the project
+            # label matches any of the project names. For extra syntax:
+            # https://prometheus.io/docs/prometheus/latest/configuration/configuration/#relabel_config
+            configs.append(
+                {
+                    "action": "replace",
+                    "source_labels": ["project"],
+                    # Relabel regexes are fully anchored
+                    "regex": "|".join(escape(name) for name in project_names),
+                    "target_label": label_name,
+                    "replacement": label_value,
+                }
+            )
+
         return configs
 
     def get_project_config(self, project: str) -> dict:
         return self.params.get("projects", {}).get(project, {})
 
-    def create_rule_files(
-        self, projects: list, manager_client: PrometheusManagerClient
-    ) -> dict:
+    def _find_shared_expressions(
+        self, projects: list, snapshot: ManagerSnapshot
+    ) -> dict[str, tuple[str, str]]:
+        """Find the alert expressions used by more than one project that are
+        worth replacing with a recording rule.
+
+        Returns a dict of normalized expression -> (name of the recording
+        rule for it, the expression as first seen)."""
+        users: dict[str, set[str]] = {}
+        originals: dict[str, str] = {}
+        for project in projects:
+            project_details = snapshot.get_project_details(project["id"])
+            for rule in project_details["alert_rules"]:
+                if not rule.get("expr"):
+                    continue
+                normalized = normalize_expr(rule["expr"])
+                if not normalized:
+                    continue
+                users.setdefault(normalized, set()).add(project["name"])
+                originals.setdefault(normalized, rule["expr"])
+
+        shared = {}
+        for normalized, project_names in users.items():
+            # Brackets in comments are not range selectors
+            cost = estimate_rule_cost(normalized)
+            if shared_expression_saving(cost, len(project_names)) <= 0:
+                continue
+
+            digest = hashlib.sha256(normalized.encode()).hexdigest()
+            shared[normalized] = (f"shared:expr_{digest[:16]}", originals[normalized])
+
+        return shared
+
+    def create_rule_files(self, projects: list, snapshot: ManagerSnapshot) -> dict:
         rule_files = {
             "alerts_global.yml": self._create_global_rules(
                 [
                     rule
-                    for rule in manager_client.get("/v1/global-alerts")
+                    for rule in snapshot.global_alerts
                     # do not deploy ones that need full global view from Thanos
                     if rule.get("mode") == "PER_PROJECT"
                 ]
             )
         }
 
+        shared_expressions = {}
+        if self.params.get("shared_recording_rules", False):
+            shared_expressions = self._find_shared_expressions(projects, snapshot)
+        # normalized expression -> number of alerts rewritten to use it
+        shared_uses: dict[str, int] = {}
+
         for project in projects:
             project_name = project.get("name")
-            project_details = manager_client.get_project_details(project["id"])
+            project_details = snapshot.get_project_details(project["id"])
             project_alert_rules = project_details["alert_rules"]
 
             if len(project_alert_rules) == 0:
                 continue
 
-            rule_files[f"alerts_project_{project_name}.yml"] = (
-                self._create_project_rules(
+            if shared_expressions:
+                # Alerts evaluate the recorded series instead of their own
+                # copy of the expression
+                rewritten_rules = []
+                for rule in project_alert_rules:
+                    normalized = normalize_expr(rule.get("expr") or "")
+                    if normalized in shared_expressions:
+                        rule = {**rule, "expr": shared_expressions[normalized][0]}
+                        shared_uses[normalized] = shared_uses.get(normalized, 0) + 1
+                    rewritten_rules.append(rule)
+                project_alert_rules = rewritten_rules
+
+            rule_files[f"alerts_project_{project_name}.yml"] = self._cached_fragment(
+                {
+                    "kind": "project_rules",
+                    "project_name": project_name,
+                    "alert_rules": project_alert_rules,
+                    "rule_group_interval": project_details.get("rule_group_interval"),
+                    "rule_group_limit": project_details.get("rule_group_limit"),
+                    "rule_groups": self.params.get("rule_groups", {}),
+                },
+                lambda: self._create_project_rules(
                     rules=project_alert_rules,
                     project_name=project_name,
+                    project_details=project_details,
+                ),
+            )
+
+        if shared_expressions:
+            rule_files[SHARED_RECORDING_RULES_FILE] = {
+                "groups": self._create_rule_groups(
+                    "shared_expressions",
+                    [
+                        {"record": name, "expr": expr}
+                        for name, expr in shared_expressions.values()
+                    ],
                 )
+            }
+
+            saved = 0
+            for normalized, uses in shared_uses.items():
+                cost = estimate_rule_cost(normalized)
+                saved += shared_expression_saving(cost, uses)
+            logger.info(
+                f"{sum(shared_uses.values())} alerts use {len(shared_expressions)} "
+                + f"shared recording rules, saving an estimated {saved} cost "
+                + "units per evaluation"
             )
 
         return rule_files
 
-    def create_thanos_rule_file(self, manager_client: PrometheusManagerClient) -> dict:
+    def create_thanos_rule_file(self, snapshot: ManagerSnapshot) -> dict:
         return self._create_global_rules(
-            [
-                rule
-                for rule in manager_client.get("/v1/global-alerts")
-                if rule.get("mode") == "GLOBAL"
-            ]
+            [rule for rule in snapshot.global_alerts if rule.get("mode") == "GLOBAL"]
         )
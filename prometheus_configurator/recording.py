@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+from prometheus_configurator.manager import PrometheusManagerClient
+
+logger = logging.getLogger(__name__)
+
+# Version 2 records the details of every project individually
+RECORDING_VERSION = 2
+
+
+def _request_key(url: str, params: Optional[dict[str, Any]]) -> str:
+    key = f"/{url.lstrip('/')}"
+    if params:
+        key += "?" + urlencode(sorted(params.items()), doseq=True)
+    return key
+
+
+class RecordingManagerClient(PrometheusManagerClient):
+    """Keeps every manager response so that they can be saved for replaying."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._recorded: dict[str, dict[str, Any]] = {}
+        self._recorded_lock = threading.Lock()
+
+    def _record(self, key: str, status: int, body: Any):
+        with self._recorded_lock:
+            self._recorded[key] = {"status": status, "body": body}
+
+    def _request(self, url, **kwargs) -> tuple[int, Any]:
+        status, body = super()._request(url, **kwargs)
+        self._record(_request_key(url, kwargs.get("params")), status, body)
+        return status, body
+
+    def get_project_details(self, project_id: int):
+        # Details may come from a bulk request, or with the change feed from
+        # the disk cache without any request at all, so record them as if
+        # they had been fetched one by one
+        details = super().get_project_details(project_id)
+        self._record(_request_key(f"/v1/projects/{project_id}", None), 200, details)
+        return details
+
+    def save(self, path: Path):
+        with self._recorded_lock:
+            with gzip.open(path, mode="wt") as file:
+                json.dump(
+                    {"version": RECORDING_VERSION, "responses": self._recorded}, file
+                )
+            logger.info(f"recorded {len(self._recorded)} manager responses to {path}")
+
+
+class ReplayManagerClient(PrometheusManagerClient):
+    """Serves manager responses from a recording without any network access."""
+
+    def __init__(self, path: Path, **kwargs):
+        super().__init__(f"replay:{path}", **kwargs)
+        self.path = path
+
+        with gzip.open(path, mode="rt") as file:
+            data = json.load(file)
+        if data.get("version") != RECORDING_VERSION:
+            raise ValueError(f"unsupported recording version in {path}")
+        self._responses: dict[str, dict[str, Any]] = data["responses"]
+
+    def prefetch_project_details(self, project_ids):
+        # Every project was recorded on its own, and serving them is cheap
+        pass
+
+    def _request(self, url, **kwargs) -> tuple[int, Any]:
+        key = _request_key(url, kwargs.get("params"))
+        if key not in self._responses:
+            # Carrying on would render the outputs from made up data
+            raise LookupError(f"no response for {key} was recorded in {self.path}")
+
+        response = self._responses[key]
+        return response["status"], response["body"]
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from typing import Iterable
+
+# Marks that a string ends at this node of the trie
+_END = ""
+
+# Characters with a special meaning in both Python and RE2 (Prometheus) syntax
+_SPECIAL = set("\\.+*?()|[]{}^$")
+_SPECIAL_IN_CLASS = set("\\]^-[")
+
+
+def _escape(char: str, special: set[str] = _SPECIAL) -> str:
+    return "\\" + char if char in special else char
+
+
+def escape(value: str) -> str:
+    return "".join(_escape(char) for char in value)
+
+
+_Trie = dict[str, "_Trie"]
+
+
+def _build_trie(values: Iterable[str]) -> _Trie:
+    trie: _Trie = {}
+    for value in values:
+        node = trie
+        for char in value:
+            node = node.setdefault(char, {})
+        node[_END] = {}
+    return trie
+
+
+def _emit(node: _Trie) -> str:
+    optional = _END in node
+    children = sorted((char, child) for char, child in node.items() if char != _END)
+    if not children:
+        return ""
+
+    # Characters that end a string with no further continuation can share a class
+    leaves = [char for char, child in children if child == {_END: {}}]
+    branches = [
+        _escape(char) + _emit(child) for char, child in children if child != {_END: {}}
+    ]
+    if len(leaves) == 1:
+        branches.append(_escape(leaves[0]))
+    elif leaves:
+        branches.append(
+            "[" + "".join(_escape(char, _SPECIAL_IN_CLASS) for char in leaves) + "]"
+        )
+
+    if len(branches) == 1 and not optional:
+        return branches[0]
+
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if optional else pattern
+
+
+def compact_alternation(values: Iterable[str]) -> str:
+    """Build a regex matching exactly the given strings.
+
+    The result is equivalent to joining the escaped values with "|" when
+    fully anchored, as Prometheus does for relabel regexes, but common
+    prefixes are only spelled out once.
+    """
+    return _emit(_build_trie(values))
@@ -0,0 +1,143 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import logging
+import subprocess
+import threading
+import time
+
+import requests
+
+from prometheus_configurator import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ReloadCoordinator:
+    """Collects the reloads requested by outputs and performs each only once."""
+
+    def __init__(self, min_interval: float = 0, dry_run: bool = False):
+        # Reloads of the same target less than this many seconds apart are
+        # postponed to a later execute() call
+        self.min_interval = min_interval
+        # Only log what would be done
+        self.dry_run = dry_run
+
+        self._lock = threading.Lock()
+        # dicts instead of sets to keep the order the intents were registered in
+        self._commands: dict[tuple[str, ...], None] = {}
+        self._restarts: dict[str, None] = {}
+        self._reloads: dict[str, None] = {}
+        self._urls: dict[str, None] = {}
+        self._last_done: dict[str, float] = {}
+
+    def run_command(self, command: list[str]):
+        with self._lock:
+            self._commands[tuple(command)] = None
+
+    def restart_unit(self, unit: str):
+        with self._lock:
+            self._restarts[unit] = None
+
+    def reload_unit(self, unit: str):
+        with self._lock:
+            self._reloads[unit] = None
+
+    def reload_url(self, url: str):
+        with self._lock:
+            self._urls[url] = None
+
+    def _take_due(self, intents: dict, prefix: str) -> list:
+        now = time.monotonic()
+        due = [
+            intent
+            for intent in intents
+            if now - self._last_done.get(f"{prefix}:{intent}", -self.min_interval)
+            >= self.min_interval
+        ]
+        for intent in due:
+            del intents[intent]
+
+        if intents:
+            logger.info(f"postponing {len(intents)} {prefix} actions")
+        return due
+
+    def _finish(self, intents: dict, prefix: str, done: list, success: bool):
+        with self._lock:
+            for intent in done:
+                if success:
+                    self._last_done[f"{prefix}:{intent}"] = time.monotonic()
+                else:
+                    # Try again on the next execute() call
+                    intents[intent] = None
+
+    def _timed(self, kind: str, description: str, function, *args) -> bool:
+        if self.dry_run:
+            logger.info(f"not going to {description} in dry run mode")
+            return True
+
+        start = time.monotonic()
+        try:
+            function(*args)
+        except (OSError, subprocess.CalledProcessError, requests.RequestException) as e:
+            logger.error(f"failed to {description}: {e}")
+            metrics.RELOADS.inc(kind=kind, result="failure")
+            return False
+        logger.info(f"{description} took {time.monotonic() - start:.2f}s")
+        metrics.RELOADS.inc(kind=kind, result="success")
+        return True
+
+    def execute(self):
+        with self._lock:
+            commands = self._take_due(self._commands, "command")
+            restarts = self._take_due(self._restarts, "restart")
+            # Restarting a unit also makes it load the new configuration
+            for unit in restarts:
+                self._reloads.pop(unit, None)
+            reloads = self._take_due(self._reloads, "reload")
+            urls = self._take_due(self._urls, "url")
+
+        results = []
+        for command in commands:
+            success = self._timed(
+                "command",
+                f"run {' '.join(command)}",
+                subprocess.check_call,
+                list(command),
+            )
+            self._finish(self._commands, "command", [command], success)
+            results.append(success)
+
+        # This will succeed even if Prometheus fails to reload its config
+        # In that case, just let it - it will alert shortly
+        if restarts:
+            success = self._timed(
+                "restart",
+                f"restart systemd units {', '.join(restarts)}",
+                subprocess.check_call,
+                ["/usr/bin/sudo", "/usr/bin/systemctl", "restart", *restarts],
+            )
+            self._finish(self._restarts, "restart", restarts, success)
+            results.append(success)
+        if reloads:
+            success = self._timed(
+                "reload",
+                f"reload systemd units {', '.join(reloads)}",
+                subprocess.check_call,
+                ["/usr/bin/sudo", "/usr/bin/systemctl", "reload", *reloads],
+            )
+            self._finish(self._reloads, "reload", reloads, success)
+            results.append(success)
+
+        for url in urls:
+            success = self._timed("url", f"reload {url}", self._post, url)
+            self._finish(self._urls, "url", [url], success)
+            results.append(success)
+
+        if not all(results):
+            raise RuntimeError(f"{results.count(False)} reload actions failed")
+
+    def _post(self, url: str):
+        requests.post(url, timeout=60).raise_for_status()
@@ -0,0 +1,289 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import contextlib
+import glob
+import hashlib
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from prometheus_configurator import create_output, metrics
+from prometheus_configurator.config import load_config_files
+from prometheus_configurator.http_cache import ResponseCache
+from prometheus_configurator.manager import PrometheusManagerClient
+from prometheus_configurator.outputs import Output
+from prometheus_configurator.profiling import Profiler
+from prometheus_configurator.recording import (
+    RecordingManagerClient,
+    ReplayManagerClient,
+)
+from prometheus_configurator.reload import ReloadCoordinator
+from prometheus_configurator.snapshot import ManagerSnapshot
+from prometheus_configurator.utils import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Output config keys with the paths of generated files and directories
+OUTPUT_PATH_KEYS = (
+    "base_directory",
+    "acl_file_path",
+    "alert_file_path",
+    "blackbox_dir",
+    "blackbox_config_path",
+    "fragment_cache_directory",
+)
+OUTPUT_DIRECTORY_KEYS = ("base_directory", "blackbox_dir", "fragment_cache_directory")
+
+
+def _reroot(path: str, root: Path) -> Path:
+    return root / Path(path).relative_to(Path(path).anchor)
+
+
+def create_manager_client(
+    manager_config: dict[str, Any], record: bool = False
+) -> PrometheusManagerClient:
+    cache_directory = manager_config.get("cache_directory")
+    client_class = RecordingManagerClient if record else PrometheusManagerClient
+    return client_class(
+        manager_config["url"],
+        max_workers=manager_config.get("max_workers", 8),
+        bulk_chunk_size=manager_config.get("bulk_chunk_size", 100),
+        cache=ResponseCache(Path(cache_directory)) if cache_directory else None,
+        timeout=manager_config.get("timeout"),
+        serve_stale=manager_config.get("serve_stale", True),
+        cache_ttl=manager_config.get("cache_ttl", 60),
+        change_feed=manager_config.get("change_feed", False),
+    )
+
+
+class Runner:
+    def __init__(
+        self,
+        config_globs: list[str],
+        skip_unchanged: bool = False,
+        record_path: Optional[Path] = None,
+        replay_path: Optional[Path] = None,
+        profiler: Optional[Profiler] = None,
+        output_root: Optional[Path] = None,
+    ):
+        if replay_path is not None and output_root is None:
+            # The recording may be from any deployment, so the files generated
+            # from it must never replace the ones actually in use
+            raise ValueError("replaying a recording needs an output root")
+
+        self.config_globs = config_globs
+        # Only render outputs whose config or manager data changed since
+        # the last run in this process
+        self.skip_unchanged = skip_unchanged
+        # Save all manager responses to, or serve them from, this file
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.profiler = profiler
+        # Write every generated file below this directory instead of the
+        # configured paths
+        self.output_root = output_root
+
+        self.config: dict[str, Any] = {}
+        self._config_mtimes: dict[Path, float] = {}
+        self.manager_client: Optional[PrometheusManagerClient] = None
+        # Files generated from a recording or outside of their configured
+        # paths are not used by anything that should be reloaded
+        self.reloader = ReloadCoordinator(
+            dry_run=replay_path is not None or output_root is not None
+        )
+
+        self._output_fingerprints: dict[str, str] = {}
+
+    def _find_config_files(self) -> list[Path]:
+        return [
+            Path(file)
+            for config_glob in self.config_globs
+            for file in glob.glob(config_glob)
+        ]
+
+    def reload_config(self) -> bool:
+        mtimes = {path: path.stat().st_mtime for path in self._find_config_files()}
+        if mtimes == self._config_mtimes:
+            return False
+
+        config = load_config_files(list(mtimes.keys()))
+        if self.output_root:
+            config = self._apply_output_root(config, self.output_root)
+        if self.manager_client is None or config.get("manager") != self.config.get(
+            "manager"
+        ):
+            self.manager_client = self._create_manager_client(config["manager"])
+
+        self.config = config
+        self._config_mtimes = mtimes
+        if self.skip_unchanged:
+            self.reloader.min_interval = config.get("reload_min_interval", 0)
+        return True
+
+    def _apply_output_root(self, config: dict[str, Any], root: Path) -> dict[str, Any]:
+        outputs = []
+        for output_config in config.get("outputs", []):
+            output_config = dict(output_config)
+            for key in OUTPUT_PATH_KEYS:
+                if key not in output_config:
+                    continue
+                path = _reroot(output_config[key], root)
+                directory = path if key in OUTPUT_DIRECTORY_KEYS else path.parent
+                directory.mkdir(parents=True, exist_ok=True)
+                output_config[key] = str(path)
+            outputs.append(output_config)
+
+        config = {**config, "outputs": outputs}
+        if "metrics_file" in config:
+            metrics_file = _reroot(config["metrics_file"], root)
+            metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            config["metrics_file"] = str(metrics_file)
+        return config
+
+    def _create_manager_client(
+        self, manager_config: dict[str, Any]
+    ) -> PrometheusManagerClient:
+        if self.replay_path:
+            return ReplayManagerClient(
+                self.replay_path,
+                bulk_chunk_size=manager_config.get("bulk_chunk_size", 100),
+            )
+        return create_manager_client(manager_config, record=bool(self.record_path))
+
+    def _output_fingerprint(self, output: Output, snapshot: ManagerSnapshot) -> str:
+        files: dict[str, Optional[str]] = {}
+        for path in output.input_files():
+            try:
+                files[str(path)] = hashlib.sha256(path.read_bytes()).hexdigest()
+            except FileNotFoundError:
+                files[str(path)] = None
+
+        return content_hash(
+            {
+                "config": output.config,
+                "main_config": output.main_config,
+                "inputs": {name: getattr(snapshot, name) for name in output.inputs},
+                "files": files,
+            }
+        )
+
+    def run_once(self):
+        start = time.monotonic()
+        success = False
+        try:
+            self._run_once()
+            success = True
+        finally:
+            metrics.RUN_DURATION.set(time.monotonic() - start)
+            metrics.RUN_TIMESTAMP.set(time.time())
+            metrics.RUN_SUCCESS.set(int(success))
+            self._write_metrics()
+
+            if self.profiler:
+                logger.info(f"profile of this run:\n{self.profiler.report()}")
+                self.profiler.reset()
+
+    def _span(self, name: str, detailed: bool = True):
+        if not self.profiler:
+            return contextlib.nullcontext()
+        return self.profiler.span(name, detailed)
+
+    def _write_metrics(self):
+        metrics_file = self.config.get("metrics_file")
+        if not metrics_file:
+            return
+        try:
+            metrics.REGISTRY.write_textfile(Path(metrics_file))
+        except OSError as e:
+            logger.error(f"failed to write metrics to {metrics_file}: {e}")
+
+    def _run_once(self):
+        self.reload_config()
+        assert self.manager_client
+
+        start = time.monotonic()
+        with self._span("fetch"):
+            snapshot = ManagerSnapshot.fetch(self.manager_client)
+            if self.record_path:
+                assert isinstance(self.manager_client, RecordingManagerClient)
+                self.manager_client.save(self.record_path)
+        metrics.PHASE_DURATION.set(time.monotonic() - start, phase="fetch")
+
+        # Outputs only share read-only inputs, so they can run concurrently
+        output_configs = self.config.get("outputs", [])
+        output_workers = self.config.get("output_workers", 1)
+        if self.profiler and self.profiler.exclusive:
+            output_workers = 1
+
+        failed = []
+        start = time.monotonic()
+        try:
+            with self._span("outputs", detailed=False), ThreadPoolExecutor(
+                max_workers=output_workers
+            ) as executor:
+                futures = [
+                    executor.submit(self._run_output, output_config, snapshot)
+                    for output_config in output_configs
+                ]
+                for output_config, future in zip(output_configs, futures):
+                    try:
+                        future.result()
+                    except Exception:
+                        logger.exception(f"{output_config.get('kind')} output failed")
+                        failed.append(output_config.get("kind"))
+        finally:
+            metrics.PHASE_DURATION.set(time.monotonic() - start, phase="outputs")
+
+            # Apply the changes of the outputs that succeeded even if others failed
+            start = time.monotonic()
+            try:
+                with self._span("reload"):
+                    self.reloader.execute()
+            finally:
+                metrics.PHASE_DURATION.set(time.monotonic() - start, phase="reload")
+
+        if failed:
+            raise RuntimeError(f"outputs failed: {', '.join(failed)}")
+
+    def _run_output(self, output_config: dict[str, Any], snapshot: ManagerSnapshot):
+        start = time.monotonic()
+        with self._span(f"outputs/{output_config.get('kind')}"):
+            self._write_output(output_config, snapshot)
+        duration = time.monotonic() - start
+        metrics.OUTPUT_DURATION.set(duration, output=output_config.get("kind", ""))
+        logger.info(f"{output_config.get('kind')} output finished in {duration:.2f}s")
+
+    def _write_output(self, output_config: dict[str, Any], snapshot: ManagerSnapshot):
+        output = create_output(output_config, self.config, self.reloader)
+
+        if not self.skip_unchanged:
+            output.write(snapshot)
+            return
+
+        key = content_hash(output_config)
+        fingerprint = self._output_fingerprint(output, snapshot)
+        if self._output_fingerprints.get(key) == fingerprint:
+            logger.info(
+                f"inputs of {output_config.get('kind')} output are unchanged, skipping"
+            )
+            return
+
+        output.write(snapshot)
+        self._output_fingerprints[key] = fingerprint
+
+    def run_forever(self, interval: float, jitter: float = 0):
+        while True:
+            start = time.monotonic()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("run failed")
+            logger.info(f"run finished in {time.monotonic() - start:.2f}s")
+
+            time.sleep(interval + random.uniform(0, jitter))
@@ -0,0 +1,231 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import IO, TYPE_CHECKING, Any, Hashable, Iterable, Union
+
+import yaml
+
+try:
+    # The libyaml based implementations are much faster
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader  # type: ignore
+
+# libyaml and the pure Python emitter break long quoted scalars, like ones
+# with escaped non-ASCII characters, into lines at different points. Long
+# lines are not broken at all, so that the output does not depend on
+# whether libyaml is installed.
+WIDTH = 2**30
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsWrite
+
+logger = logging.getLogger(__name__)
+
+
+def dump(data: Any) -> str:
+    return yaml.dump(data, Dumper=SafeDumper, width=WIDTH)
+
+
+def dump_streaming(
+    data: dict[str, Any], key: str, items: Iterable[Any], stream: SupportsWrite[str]
+):
+    """Write what dump() would for data with key mapping to a list of items.
+
+    The items are dumped one by one, so they can be produced lazily and
+    never need to be in memory at the same time. key must sort after every
+    key in data, as dump() sorts the keys of mappings."""
+    assert all(other < key for other in data), f"{key} must be the last key"
+
+    if data:
+        yaml.dump(data, stream, Dumper=SafeDumper, width=WIDTH)
+
+    empty = True
+    for item in items:
+        if empty:
+            stream.write(f"{key}:\n")
+            empty = False
+        # Sequences in block mappings are not indented, so a one item list
+        # renders exactly like that item would as a part of the whole list
+        yaml.dump([item], stream, Dumper=SafeDumper, width=WIDTH)
+
+    if empty:
+        yaml.dump({key: []}, stream, Dumper=SafeDumper, width=WIDTH)
+
+
+@dataclass(eq=False)
+class _Merged:
+    """A mapping written as a YAML merge of a shared base and its own keys."""
+
+    base: dict
+    extra: dict
+
+
+class _AliasingDumper(SafeDumper):
+    pass
+
+
+def _represent_merged(dumper: _AliasingDumper, data: _Merged) -> yaml.Node:
+    value: list[tuple[yaml.Node, yaml.Node]] = [
+        (
+            yaml.ScalarNode("tag:yaml.org,2002:merge", "<<"),
+            dumper.represent_data(data.base),
+        )
+    ]
+    for key, item in sorted(data.extra.items()):
+        value.append((dumper.represent_data(key), dumper.represent_data(item)))
+    return yaml.MappingNode("tag:yaml.org,2002:map", value)
+
+
+_AliasingDumper.add_representer(_Merged, _represent_merged)
+
+
+def share_equal_structures(
+    data: Any, merge_bases: Iterable[dict] = (), min_size: int = 4
+) -> Any:
+    """Return a copy of data in which equal mappings and lists are one object.
+
+    The dumper writes an object that appears several times in full only once,
+    with an anchor, and refers to it with an alias everywhere else. Mappings
+    that contain every key and value of one of merge_bases, plus some of
+    their own, are written as a merge of that base and the remaining keys.
+    Structures with fewer than min_size keys and scalars are left alone, as
+    an alias would hardly make them any shorter."""
+    shared: dict[Hashable, Any] = {}
+
+    def visit(value: Any) -> tuple[Any, Hashable, int]:
+        if isinstance(value, dict):
+            children = {name: visit(item) for name, item in value.items()}
+            result: Any = {name: child[0] for name, child in children.items()}
+            size = len(children) + sum(child[2] for child in children.values())
+
+            for base, base_children in bases:
+                if len(children) > len(base_children) and all(
+                    name in children and children[name][1] == base_key
+                    for name, base_key in base_children.items()
+                ):
+                    extra = {
+                        name: child
+                        for name, child in children.items()
+                        if name not in base_children
+                    }
+                    result = _Merged(
+                        base, {name: child[0] for name, child in extra.items()}
+                    )
+                    children = {"<<": (base, ("ref", id(base)), 0), **extra}
+                    break
+
+            key: Hashable = (
+                type(result).__name__,
+                tuple(
+                    sorted(
+                        ((name, child[1]) for name, child in children.items()),
+                        key=lambda item: repr(item[0]),
+                    )
+                ),
+            )
+        elif isinstance(value, list):
+            items = [visit(item) for item in value]
+            result = [item[0] for item in items]
+            size = sum(item[2] for item in items)
+            key = ("list", tuple(item[1] for item in items))
+        else:
+            # Include the type, as for example 1 and True are equal in Python
+            return value, (type(value), value), 1
+
+        if size < min_size:
+            return result, key, size
+
+        # Refer to shared structures by identity to keep the keys of their
+        # parents small
+        result = shared.setdefault(key, result)
+        return result, ("ref", id(result)), size
+
+    bases: list[tuple[dict, dict[Any, Hashable]]] = []
+    for base in merge_bases:
+        base_children = {name: visit(item) for name, item in base.items()}
+        bases.append(
+            (
+                {name: child[0] for name, child in base_children.items()},
+                {name: child[1] for name, child in base_children.items()},
+            )
+        )
+
+    return visit(data)[0]
+
+
+def _allowed_alias_ratio(decoded: int) -> float:
+    # From the "excessive aliasing" check of go-yaml, which Prometheus uses
+    if decoded <= 400_000:
+        return 0.99
+    if decoded >= 4_000_000:
+        return 0.10
+    return 0.99 - 0.89 * (decoded - 400_000) / 3_600_000
+
+
+def has_excessive_aliasing(data: Any, decode_factor: int = 2) -> bool:
+    """Whether go-yaml would refuse to load data as dumped with aliases.
+
+    go-yaml counts the nodes it decodes, including every node of an aliased
+    structure each time the alias is used, and fails once too large a share
+    of them came from aliases. That share shrinks as documents get larger.
+    Prometheus decodes many nodes again in its custom unmarshalers, so the
+    limit is looked up for decode_factor times as many nodes as counted here
+    to stay on the safe side."""
+    decoded = 0
+    aliased = 0
+    emitted: set[int] = set()
+
+    def visit(value: Any, in_alias: bool) -> bool:
+        nonlocal decoded, aliased
+        decoded += 1
+        if in_alias:
+            aliased += 1
+            if (
+                aliased > 100
+                and decoded > 1000
+                and aliased / decoded > _allowed_alias_ratio(decode_factor * decoded)
+            ):
+                return True
+
+        if not isinstance(value, (dict, list, _Merged)):
+            return False
+        if id(value) in emitted:
+            # The alias node was counted above, now the structure it refers to
+            # is decoded again
+            in_alias = True
+        emitted.add(id(value))
+
+        if isinstance(value, _Merged):
+            children: list[Any] = ["<<", value.base]
+            for name, item in value.extra.items():
+                children.extend([name, item])
+        elif isinstance(value, dict):
+            children = [child for item in value.items() for child in item]
+        else:
+            children = value
+        return any(visit(child, in_alias) for child in children)
+
+    return visit(data, False)
+
+
+def dump_with_aliases(data: Any, merge_bases: Iterable[dict] = ()) -> str:
+    """Dump data with repeated structures written once and referred to with
+    aliases. Loading the result gives data back as it was.
+
+    If go-yaml would consider the result to have too many aliases, data is
+    dumped without any instead."""
+    shared = share_equal_structures(data, merge_bases)
+    if has_excessive_aliasing(shared):
+        logger.warning("too many YAML aliases for go-yaml, dumping without them")
+        return dump(data)
+    return yaml.dump(shared, Dumper=_AliasingDumper, width=WIDTH)
+
+
+def load(stream: Union[str, IO]) -> Any:
+    return yaml.load(stream, Loader=SafeLoader)
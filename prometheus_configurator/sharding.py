@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _score(project_name: str, shard: int) -> int:
+    digest = hashlib.sha256(f"{shard}/{project_name}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def assign_shard(
+    project_name: str, shard_count: int, shard_map: Optional[dict[str, int]] = None
+) -> int:
+    if shard_map and project_name in shard_map:
+        return shard_map[project_name]
+
+    # Rendezvous hashing: when a shard is added, only the projects that
+    # now score highest on the new shard move there.
+    return max(range(shard_count), key=lambda shard: _score(project_name, shard))
+
+
+class Sharding:
+    def __init__(self, config: dict[str, Any]):
+        self.shard_count: int = config["shard_count"]
+        self.shard_index: int = config["shard_index"]
+        self.shard_map: dict[str, int] = config.get("shard_map", {})
+
+        if not 0 <= self.shard_index < self.shard_count:
+            raise ValueError(
+                f"shard_index {self.shard_index} is not in range for {self.shard_count} shards"
+            )
+        for project_name, shard in self.shard_map.items():
+            if not 0 <= shard < self.shard_count:
+                raise ValueError(
+                    f"shard_map assigns project {project_name} to shard {shard}, "
+                    + f"which is not in range for {self.shard_count} shards"
+                )
+
+    def shard_for(self, project_name: str) -> int:
+        return assign_shard(project_name, self.shard_count, self.shard_map)
+
+    def filter_projects(self, projects: list) -> list:
+        return [
+            project
+            for project in projects
+            if self.shard_for(project["name"]) == self.shard_index
+        ]
+
+    def log_report(
+        self,
+        projects: list,
+        get_project_details: Callable[[int], dict],
+        global_jobs: list,
+    ):
+        weights = {
+            shard: {"projects": 0, "jobs": 0, "targets": 0, "rules": 0}
+            for shard in range(self.shard_count)
+        }
+
+        for project in projects:
+            details = get_project_details(project["id"])
+            weight = weights[self.shard_for(project["name"])]
+            weight["projects"] += 1
+            weight["jobs"] += len(global_jobs) + len(details["scrapes"])
+            # OpenStack discovered jobs count as one target as their real
+            # number of targets is not known until Prometheus has discovered them
+            weight["targets"] += len(global_jobs) + sum(
+                len(scrape.get("static_discovery") or []) or 1
+                for scrape in details["scrapes"]
+            )
+            weight["rules"] += len(details["alert_rules"])
+
+        for shard, weight in weights.items():
+            marker = " (this instance)" if shard == self.shard_index else ""
+            logger.info(
+                f"shard {shard}{marker}: "
+                + ", ".join(f"{name}={value}" for name, value in weight.items())
+            )
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+from prometheus_configurator.manager import PrometheusManagerClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ManagerSnapshot:
+    """All manager data needed for a single run, shared by every output."""
+
+    projects: list[dict[str, Any]]
+    project_details: dict[int, dict[str, Any]]
+    contact_groups: list[dict[str, Any]]
+    supported_openstack_images: list[dict[str, Any]]
+    global_alerts: list[dict[str, Any]]
+
+    @classmethod
+    def fetch(cls, client: PrometheusManagerClient) -> ManagerSnapshot:
+        start = time.monotonic()
+        client.sync_changes()
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            contact_groups = executor.submit(client.get_contact_groups)
+            images = executor.submit(client.get_supported_openstack_images)
+            global_alerts = executor.submit(client.get_global_alerts)
+
+            projects = client.get_projects()
+            client.prefetch_project_details([project["id"] for project in projects])
+
+            snapshot = cls(
+                projects=projects,
+                project_details={
+                    project["id"]: client.get_project_details(project["id"])
+                    for project in projects
+                },
+                contact_groups=contact_groups.result(),
+                supported_openstack_images=images.result(),
+                global_alerts=global_alerts.result(),
+            )
+
+        logger.info(
+            f"fetched data for {len(projects)} projects from the manager "
+            + f"in {time.monotonic() - start:.2f}s"
+        )
+        return snapshot
+
+    def get_project_details(self, project_id: int) -> dict[str, Any]:
+        return self.project_details[project_id]
@@ -3,15 +3,28 @@
 
 from __future__ import annotations
 
+import functools
+import hashlib
+import json
+import os
+import stat
+import tempfile
+from pathlib import Path
+from typing import Any
+
 
 # Based on https://github.com/wikimedia/wikimedia-bots-jouncebot/blob/master/jouncebot/configloader.py
 def merge(new_vals, existing_obj):
+    # Neither argument is modified, as both may be reused, for example
+    # for every run in daemon mode
     if isinstance(new_vals, dict) and isinstance(existing_obj, dict):
-        for k, v in list(existing_obj.items()):
-            if k not in new_vals:
-                new_vals[k] = v
+        merged = dict(new_vals)
+        for k, v in existing_obj.items():
+            if k not in merged:
+                merged[k] = v
             else:
-                new_vals[k] = merge(new_vals[k], v)
+                merged[k] = merge(merged[k], v)
+        return merged
     elif isinstance(new_vals, list) and isinstance(existing_obj, list):
         return [*new_vals, *existing_obj]
     return new_vals
@@ -19,3 +32,57 @@ def merge(new_vals, existing_obj):
 
 def camelcase_projectname(original: str) -> str:
     return "".join([part.title() for part in original.split("-")])
+
+
+@functools.cache
+def _get_umask() -> int:
+    # Reading the umask via os.umask() means changing it for a moment,
+    # which can affect files created by other threads at the same time
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def create_temporary_file(path: Path) -> tuple[int, str]:
+    """Create a file next to path to be renamed over it once written.
+
+    The file gets the permissions path has, or would get if it was created."""
+    try:
+        mode = stat.S_IMODE(path.stat().st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_get_umask()
+
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        # mkstemp() creates files only readable by the owner
+        os.fchmod(fd, mode)
+    except BaseException:
+        os.close(fd)
+        os.unlink(temp_name)
+        raise
+    return fd, temp_name
+
+
+def write_atomically(path: Path, content: str):
+    fd, temp_name = create_temporary_file(path)
+    try:
+        with os.fdopen(fd, mode="w") as file:
+            file.write(content)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def content_hash(data: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode()
+    ).hexdigest()
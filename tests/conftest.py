@@ -0,0 +1,21 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import pytest
+
+from benchmarks.fleet import generate_fleet
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+@pytest.fixture
+def snapshot() -> ManagerSnapshot:
+    fleet = generate_fleet(50)
+    return ManagerSnapshot(
+        projects=fleet.projects,
+        project_details=fleet.project_details,
+        contact_groups=fleet.contact_groups,
+        supported_openstack_images=fleet.images,
+        global_alerts=fleet.global_alerts,
+    )
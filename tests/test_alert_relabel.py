@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import random
+import re
+from typing import Any
+
+import pytest
+
+from prometheus_configurator.prometheus import ConfigFileCreator
+
+
+def _relabel(configs: list[dict[str, Any]], labels: dict[str, str]) -> dict[str, str]:
+    """Apply the subset of Prometheus relabeling used for alerts."""
+    labels = dict(labels)
+    for config in configs:
+        if config["action"] == "labeldrop":
+            labels = {
+                name: value
+                for name, value in labels.items()
+                if not re.fullmatch(config["regex"], name)
+            }
+        elif config["action"] == "replace":
+            value = ";".join(labels.get(name, "") for name in config["source_labels"])
+            if re.fullmatch(config["regex"], value):
+                labels[config["target_label"]] = config["replacement"]
+        else:
+            raise NotImplementedError(config["action"])
+    return labels
+
+
+def _per_project_relabel_configs(projects: list[dict[str, Any]]) -> list[dict]:
+    """The rules as generated before projects sharing a label were grouped,
+    except with the project names escaped."""
+    configs: list[dict[str, Any]] = [{"action": "labeldrop", "regex": "replica"}]
+    for project in projects:
+        for label_name, label_value in (project["extra_labels"] or {}).items():
+            configs.append(
+                {
+                    "action": "replace",
+                    "source_labels": ["project"],
+                    "regex": re.escape(project["name"]),
+                    "target_label": label_name,
+                    "replacement": label_value,
+                }
+            )
+    return configs
+
+
+def _random_projects(rng: random.Random) -> list[dict[str, Any]]:
+    projects = []
+    for i in range(rng.randint(0, 30)):
+        labels = {
+            name: rng.choice(["a", "b", "c"])
+            for name in rng.sample(["team", "tier", "site"], k=rng.randint(0, 3))
+        }
+        projects.append(
+            {
+                "id": i,
+                # Dots and dashes are valid in project names
+                "name": rng.choice(["tools", "deployment-prep", "a.b", "ab"]) + f"-{i}",
+                "extra_labels": labels if labels or rng.random() < 0.5 else None,
+            }
+        )
+    return projects
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_grouped_relabel_configs_match_per_project_configs(seed: int):
+    rng = random.Random(seed)
+    projects = _random_projects(rng)
+
+    grouped = ConfigFileCreator({})._create_alert_relabel_configs(projects)
+    per_project = _per_project_relabel_configs(projects)
+
+    for project_name in [project["name"] for project in projects] + ["other", "a-b"]:
+        alert = {"alertname": "Down", "project": project_name, "replica": "a"}
+        assert _relabel(grouped, alert) == _relabel(per_project, alert)
+
+
+def test_projects_sharing_a_label_get_one_rule():
+    projects = [
+        {"id": 1, "name": "a.b", "extra_labels": {"team": "x"}},
+        {"id": 2, "name": "c", "extra_labels": {"team": "x"}},
+    ]
+    configs = ConfigFileCreator({})._create_alert_relabel_configs(projects)
+    assert configs[1:] == [
+        {
+            "action": "replace",
+            "source_labels": ["project"],
+            "regex": "a\\.b|c",
+            "target_label": "team",
+            "replacement": "x",
+        }
+    ]
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.fleet import create_main_config
+from prometheus_configurator import serialization
+from prometheus_configurator.outputs.prometheus import PrometheusOutput
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+def _write(
+    directory: Path, snapshot: ManagerSnapshot, **output_config: Any
+) -> PrometheusOutput:
+    directory.mkdir()
+    output = PrometheusOutput(
+        {
+            "kind": "prometheus",
+            "base_directory": str(directory),
+            "blackbox_address": "localhost:9115",
+            "fqdn_template": "{instance}.{project}.example.org",
+            **output_config,
+        },
+        create_main_config(directory),
+    )
+    output.write(snapshot)
+    return output
+
+
+def _probe_settings(directory: Path) -> dict[str, dict]:
+    """The blackbox module each job probes with."""
+    prometheus_config = serialization.load((directory / "prometheus.yml").read_text())
+    modules = serialization.load((directory / "blackbox.yml").read_text())["modules"]
+    return {
+        job["job_name"]: modules[job["params"]["module"][0]]
+        for job in prometheus_config["scrape_configs"]
+        if "module" in job["params"]
+    }
+
+
+def test_shared_modules_keep_the_probe_settings_of_every_job(
+    tmp_path: Path, snapshot: ManagerSnapshot
+):
+    _write(
+        tmp_path / "separate",
+        snapshot,
+        blackbox_config_path=str(tmp_path / "separate" / "blackbox.yml"),
+    )
+    _write(
+        tmp_path / "shared",
+        snapshot,
+        blackbox_config_path=str(tmp_path / "shared" / "blackbox.yml"),
+        blackbox_shared_modules=True,
+    )
+
+    separate = _probe_settings(tmp_path / "separate")
+    shared = _probe_settings(tmp_path / "shared")
+
+    assert separate
+    assert shared == separate
+
+    shared_modules = serialization.load((tmp_path / "shared/blackbox.yml").read_text())
+    assert len(shared_modules["modules"]) < len(separate)
+
+
+def test_shared_modules_require_a_single_blackbox_config(
+    tmp_path: Path, snapshot: ManagerSnapshot
+):
+    with pytest.raises(ValueError, match="blackbox_config_path"):
+        _write(
+            tmp_path / "prometheus",
+            snapshot,
+            blackbox_dir=str(tmp_path / "blackbox"),
+            blackbox_reload="/bin/true",
+            blackbox_shared_modules=True,
+        )
@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from benchmarks.fleet import FakeManager, generate_fleet
+from prometheus_configurator.http_cache import ResponseCache
+from prometheus_configurator.manager import (
+    CHANGE_FEED_CURSOR_FILE,
+    PrometheusManagerClient,
+)
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+@pytest.fixture
+def manager() -> Iterator[FakeManager]:
+    with FakeManager(generate_fleet(20)) as manager:
+        yield manager
+
+
+def _client(manager: FakeManager, cache: Path) -> PrometheusManagerClient:
+    # A new client for every run, like separate invocations of the script
+    return PrometheusManagerClient(
+        manager.url, cache=ResponseCache(cache), change_feed=True
+    )
+
+
+def _run(manager: FakeManager, cache: Path) -> int:
+    """Fetch a snapshot, check that it is up to date and return the number
+    of requests it took."""
+    before = manager.request_count
+    snapshot = ManagerSnapshot.fetch(_client(manager, cache))
+    assert snapshot == ManagerSnapshot(
+        projects=manager.fleet.projects,
+        project_details=manager.fleet.project_details,
+        contact_groups=manager.fleet.contact_groups,
+        supported_openstack_images=manager.fleet.images,
+        global_alerts=manager.fleet.global_alerts,
+    )
+    return manager.request_count - before
+
+
+def _cursor(cache: Path) -> str:
+    return (cache / CHANGE_FEED_CURSOR_FILE).read_text()
+
+
+def test_unchanged_runs_only_ask_for_changes(manager: FakeManager, tmp_path: Path):
+    _run(manager, tmp_path)
+
+    assert _run(manager, tmp_path) == 1
+
+
+def test_changes_are_fetched_again(manager: FakeManager, tmp_path: Path):
+    _run(manager, tmp_path)
+
+    manager.update_project({**manager.fleet.project_details[3], "acl_group": "new"})
+    manager.update_project({**manager.fleet.project_details[7], "acl_group": "new"})
+    manager.fleet.contact_groups.append({"name": "new", "members": []})
+    manager.record_change("contact-groups")
+
+    # The changes, a bulk request for both projects and the contact groups
+    assert _run(manager, tmp_path) == 3
+    assert _run(manager, tmp_path) == 1
+
+
+def test_cursor_is_kept_between_runs(manager: FakeManager, tmp_path: Path):
+    _run(manager, tmp_path)
+    assert _cursor(tmp_path) == "0"
+
+    manager.update_project({**manager.fleet.project_details[3], "acl_group": "new"})
+    _run(manager, tmp_path)
+    assert _cursor(tmp_path) == "1"
+
+
+@pytest.mark.parametrize("cursor", ["expired", "100"])
+def test_unknown_cursors_refresh_everything(
+    manager: FakeManager, tmp_path: Path, cursor: str
+):
+    _run(manager, tmp_path)
+    (tmp_path / CHANGE_FEED_CURSOR_FILE).write_text(cursor)
+    manager.fleet.images.append({"openstack_id": "new-image"})
+
+    # The changes twice, the lists and a bulk request for every project
+    assert _run(manager, tmp_path) == 7
+    assert _cursor(tmp_path) == "0"
+    assert _run(manager, tmp_path) == 1
+
+
+def test_managers_without_a_change_feed_are_asked_for_everything(tmp_path: Path):
+    with FakeManager(generate_fleet(20), change_feed=False) as manager:
+        first = _run(manager, tmp_path)
+
+        manager.update_project({**manager.fleet.project_details[3], "acl_group": "x"})
+        assert _run(manager, tmp_path) == first
+
+    assert not (tmp_path / CHANGE_FEED_CURSOR_FILE).exists()
+
+
+def test_missing_cache_entries_are_fetched_again(manager: FakeManager, tmp_path: Path):
+    _run(manager, tmp_path)
+
+    client = _client(manager, tmp_path)
+    assert client.cache
+    client.cache.delete(client._cache_key("/v1/projects/3"))
+    client.cache.delete(client._cache_key("/v1/global-alerts"))
+
+    # Even though the change feed does not list them
+    assert _run(manager, tmp_path) == 3
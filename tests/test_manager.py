@@ -0,0 +1,162 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import functools
+import json
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pytest
+import requests
+
+from prometheus_configurator import metrics
+from prometheus_configurator.http_cache import CachedResponse, ResponseCache
+from prometheus_configurator.manager import PrometheusManagerClient
+
+BASE_URL = "http://manager.example.org"
+
+
+def _response(
+    status: int, body: Any = None, text: str = "", headers: Optional[dict] = None
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = (json.dumps(body) if body is not None else text).encode()
+    response.headers.update(headers or {})
+    return response
+
+
+class StubClient(PrometheusManagerClient):
+    """Answers requests with a function instead of over HTTP."""
+
+    def __init__(self, respond: Callable[..., requests.Response], **kwargs: Any):
+        super().__init__(BASE_URL, **kwargs)
+        self.respond = respond
+        self.requests: list[tuple[str, dict]] = []
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        self.requests.append((url[len(BASE_URL) :], kwargs))
+        return self.respond(url[len(BASE_URL) :], **kwargs)
+
+
+def test_bulk_details_fall_back_on_non_json_errors():
+    def respond(path: str, params=None, **kwargs) -> requests.Response:
+        if params:
+            # Like an older manager behind a web server with HTML error pages
+            return _response(404, text="<html>Not Found</html>")
+        return _response(200, {"id": int(path.rsplit("/", 1)[1]), "alert_rules": []})
+
+    client = StubClient(respond)
+    client.prefetch_project_details([1, 2, 3])
+
+    assert client._bulk_supported is False
+    assert client.get_project_details(2) == {"id": 2, "alert_rules": []}
+    assert sorted(path for path, _ in client.requests[1:]) == [
+        "/v1/projects/1",
+        "/v1/projects/2",
+        "/v1/projects/3",
+    ]
+
+
+def test_get_raises_on_errors():
+    client = StubClient(lambda path, **kwargs: _response(500, text="oops"))
+
+    with pytest.raises(requests.HTTPError, match="500"):
+        client.get_projects()
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> ResponseCache:
+    cache = ResponseCache(tmp_path)
+    cache.store(
+        CachedResponse(url=f"{BASE_URL}/v1/projects", body=[{"id": 1}], etag='"v1"')
+    )
+    return cache
+
+
+def test_not_modified_uses_the_cached_body(cache: ResponseCache):
+    client = StubClient(lambda path, **kwargs: _response(304), cache=cache)
+
+    assert client.get_projects() == [{"id": 1}]
+    assert client.requests[0][1]["headers"]["If-None-Match"] == '"v1"'
+
+
+def test_modified_responses_replace_the_cached_body(cache: ResponseCache):
+    client = StubClient(
+        lambda path, **kwargs: _response(200, [{"id": 2}], headers={"ETag": '"v2"'}),
+        cache=cache,
+    )
+
+    assert client.get_projects() == [{"id": 2}]
+    cached = cache.load(f"{BASE_URL}/v1/projects")
+    assert cached and cached.body == [{"id": 2}] and cached.etag == '"v2"'
+
+
+def test_server_errors_serve_stale_data(cache: ResponseCache):
+    client = StubClient(lambda path, **kwargs: _response(503, text="down"), cache=cache)
+    assert client.get_projects() == [{"id": 1}]
+
+    client.serve_stale = False
+    with pytest.raises(requests.HTTPError, match="503"):
+        client.get_projects()
+
+
+def test_timeouts_serve_stale_data(cache: ResponseCache):
+    def respond(path: str, **kwargs) -> requests.Response:
+        raise requests.Timeout("timed out")
+
+    client = StubClient(respond, cache=cache)
+    assert client.get_projects() == [{"id": 1}]
+
+    client.serve_stale = False
+    with pytest.raises(requests.Timeout):
+        client.get_projects()
+
+
+def _project_details_cache() -> dict[str, float]:
+    samples = (sample.split() for sample in metrics.PROJECT_DETAILS_CACHE.samples())
+    return {
+        labels.split('"')[1]: float(value)
+        for labels, value in samples
+        if labels.startswith(metrics.PROJECT_DETAILS_CACHE.name)
+    }
+
+
+def _count_project_details(fetch: Callable[[], Any]) -> dict[str, float]:
+    before = _project_details_cache()
+    fetch()
+    after = _project_details_cache()
+    return {
+        result: after.get(result, 0) - before.get(result, 0)
+        for result in ["hit", "miss"]
+    }
+
+
+def test_project_details_cache_counts_http_cache_use(tmp_path: Path):
+    statuses = iter([200, 304, 503])
+
+    def respond(path: str, **kwargs) -> requests.Response:
+        return _response(next(statuses), {"id": 1, "alert_rules": []})
+
+    client = StubClient(respond, cache=ResponseCache(tmp_path), cache_ttl=0)
+    fetch = functools.partial(client.get_project_details, 1)
+
+    assert _count_project_details(fetch) == {"hit": 0, "miss": 1}
+    # Not modified, and then served stale
+    assert _count_project_details(fetch) == {"hit": 1, "miss": 0}
+    assert _count_project_details(fetch) == {"hit": 1, "miss": 0}
+
+
+def test_project_details_cache_counts_every_bulk_result():
+    def respond(path: str, params=None, **kwargs) -> requests.Response:
+        return _response(200, [{"id": id, "alert_rules": []} for id in params["id"]])
+
+    client = StubClient(respond)
+    fetch = functools.partial(client.prefetch_project_details, [1, 2, 3])
+
+    assert _count_project_details(fetch) == {"hit": 0, "miss": 3}
+    # Answered from memory without involving the manager or its cache
+    fetch = functools.partial(client.get_project_details, 2)
+    assert _count_project_details(fetch) == {"hit": 0, "miss": 0}
@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from prometheus_configurator import serialization
+from prometheus_configurator.manifest import MANIFEST_NAME
+from prometheus_configurator.outputs.prometheus import PrometheusOutput
+
+KEPT = {"groups": [{"name": "kept", "rules": []}]}
+
+
+def _output() -> PrometheusOutput:
+    return PrometheusOutput({"kind": "prometheus"}, {})
+
+
+def test_upgrade_deletes_files_generated_before_the_manifest(tmp_path: Path):
+    (tmp_path / "alerts_project_kept.yml").write_text(serialization.dump(KEPT))
+    (tmp_path / "alerts_project_deleted.yml").write_text(serialization.dump(KEPT))
+    (tmp_path / "external.yml").write_text("groups: []\n")
+    (tmp_path / "notes.txt").write_text("not a rule file")
+    kept_mtime = (tmp_path / "alerts_project_kept.yml").stat().st_mtime_ns
+
+    assert _output().write_directory(
+        tmp_path, {"alerts_project_kept.yml": KEPT}, ["external.yml"]
+    )
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        MANIFEST_NAME,
+        f"{MANIFEST_NAME}.lock",
+        "alerts_project_kept.yml",
+        "external.yml",
+        "notes.txt",
+    ]
+    # Unchanged files are not rewritten while upgrading
+    assert (tmp_path / "alerts_project_kept.yml").stat().st_mtime_ns == kept_mtime
+
+
+def test_only_files_in_the_manifest_are_deleted(tmp_path: Path):
+    output = _output()
+    output.write_directory(
+        tmp_path, {"alerts_project_a.yml": KEPT, "alerts_project_b.yml": KEPT}, []
+    )
+    # Added by someone else once the manifest exists
+    (tmp_path / "manual.yml").write_text("groups: []\n")
+
+    assert output.write_directory(tmp_path, {"alerts_project_a.yml": KEPT}, [])
+    assert not output.write_directory(tmp_path, {"alerts_project_a.yml": KEPT}, [])
+
+    assert sorted(path.name for path in tmp_path.glob("*.yml")) == [
+        "alerts_project_a.yml",
+        "manual.yml",
+    ]
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.fleet import create_main_config
+from prometheus_configurator.prometheus import ConfigFileCreator
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+# Regex metacharacters in project names must only match themselves
+PROJECT = {"id": 1, "name": "tools.b+eta", "extra_labels": {}}
+
+
+def _jobs(main_config: dict[str, Any], mode: str) -> list[dict[str, Any]]:
+    snapshot = ManagerSnapshot(
+        projects=[PROJECT],
+        project_details={
+            1: {
+                **PROJECT,
+                "scrapes": [{"name": "node", "openstack_discovery": {"port": 9100}}],
+                "alert_rules": [],
+            }
+        },
+        contact_groups=[],
+        supported_openstack_images=[{"openstack_id": "image-1"}],
+        global_alerts=[],
+    )
+    config, _ = ConfigFileCreator(main_config).create_prometheus_config(
+        snapshot.projects,
+        snapshot,
+        [],
+        {
+            "fqdn_template": "{instance}.{project}.example.org",
+            "openstack_discovery_mode": mode,
+        },
+    )
+    return [
+        job for job in config["scrape_configs"] if job["job_name"] == "tools.b+eta_node"
+    ]
+
+
+def _keeps(job: dict[str, Any], label: str, value: str) -> bool:
+    return all(
+        re.fullmatch(config["regex"], value)
+        for config in job["relabel_configs"]
+        if config.get("action") == "keep" and config["source_labels"] == [label]
+    )
+
+
+def test_project_name_mode_scopes_discovery_to_the_project(tmp_path: Path):
+    (job,) = _jobs(create_main_config(tmp_path), "project_name")
+    (sd_config,) = job["openstack_sd_configs"]
+
+    assert sd_config["project_name"] == "tools.b+eta"
+    assert sd_config["all_tenants"] is False
+    assert sd_config["port"] == 9100
+
+
+def test_all_tenants_mode_filters_instances_by_project(tmp_path: Path):
+    (job,) = _jobs(create_main_config(tmp_path), "all_tenants")
+    (sd_config,) = job["openstack_sd_configs"]
+
+    # Scoped to the monitoring project to get a token able to list instances
+    assert sd_config["project_name"] == "admin-monitoring"
+    assert sd_config["all_tenants"] is True
+    assert sd_config["port"] == 9100
+    assert sd_config["username"] == "prometheus"
+
+    assert _keeps(job, "__meta_openstack_project_id", "tools.b+eta")
+    assert not _keeps(job, "__meta_openstack_project_id", "toolsxb+eta")
+    assert not _keeps(job, "__meta_openstack_project_id", "tools.bbeta")
+    assert not _keeps(job, "__meta_openstack_project_id", "tools.b+eta2")
+    assert not _keeps(job, "__meta_openstack_project_id", "admin-monitoring")
+
+
+def test_all_tenants_mode_needs_a_project_to_scope_to(tmp_path: Path):
+    main_config = create_main_config(tmp_path)
+    del main_config["openstack"]["all_tenants_project_name"]
+
+    with pytest.raises(ValueError, match="all_tenants_project_name"):
+        _jobs(main_config, "all_tenants")
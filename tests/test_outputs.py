@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import copy
+from pathlib import Path
+from typing import Any
+
+from benchmarks.fleet import create_main_config
+from prometheus_configurator import create_output
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+def test_outputs_do_not_modify_the_snapshot(tmp_path: Path, snapshot: ManagerSnapshot):
+    for project in snapshot.projects:
+        for scrape in snapshot.get_project_details(project["id"])["scrapes"]:
+            blackbox = scrape.get("blackbox")
+            if blackbox and blackbox["type"] == "http":
+                blackbox["headers"] = {"User-Agent": "probe"}
+                blackbox["host"] = f"{project['name']}.example.org"
+                blackbox["valid_status_codes"] = [200]
+    before = copy.deepcopy(snapshot)
+
+    main_config = create_main_config(tmp_path)
+    (tmp_path / "prometheus").mkdir()
+    output_configs: list[dict[str, Any]] = [
+        {
+            "kind": "prometheus",
+            "base_directory": str(tmp_path / "prometheus"),
+            "blackbox_address": "localhost:9115",
+            "blackbox_config_path": str(tmp_path / "blackbox.yml"),
+            "blackbox_shared_modules": True,
+            "fqdn_template": "{instance}.{project}.example.org",
+        },
+        {"kind": "alertmanager", "base_directory": str(tmp_path)},
+        {"kind": "karma_acl", "acl_file_path": str(tmp_path / "acl.yml")},
+        {"kind": "thanos_rule", "alert_file_path": str(tmp_path / "thanos.yml")},
+    ]
+    for output_config in output_configs:
+        create_output(output_config, main_config).write(snapshot)
+
+    assert snapshot == before
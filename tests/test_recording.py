@@ -0,0 +1,65 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.fleet import FakeManager, generate_fleet
+from prometheus_configurator.http_cache import ResponseCache
+from prometheus_configurator.recording import (
+    RecordingManagerClient,
+    ReplayManagerClient,
+)
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+def _replay(path: Path, **kwargs: Any) -> ManagerSnapshot:
+    return ManagerSnapshot.fetch(ReplayManagerClient(path, **kwargs))
+
+
+@pytest.mark.parametrize("bulk_chunk_size", [0, 7])
+def test_replay_gives_the_recorded_snapshot(tmp_path: Path, bulk_chunk_size: int):
+    with FakeManager(generate_fleet(20)) as manager:
+        client = RecordingManagerClient(manager.url, bulk_chunk_size=bulk_chunk_size)
+        recorded = ManagerSnapshot.fetch(client)
+        client.save(tmp_path / "recording.json.gz")
+
+    assert _replay(tmp_path / "recording.json.gz") == recorded
+
+
+def test_replay_of_a_run_following_the_change_feed(tmp_path: Path):
+    fleet = generate_fleet(20)
+    with FakeManager(fleet) as manager:
+
+        def client() -> RecordingManagerClient:
+            return RecordingManagerClient(
+                manager.url,
+                cache=ResponseCache(tmp_path / "cache"),
+                change_feed=True,
+            )
+
+        # Starts following the feed
+        ManagerSnapshot.fetch(client())
+
+        manager.update_project({**fleet.project_details[3], "acl_group": "changed"})
+        recording_client = client()
+        recorded = ManagerSnapshot.fetch(recording_client)
+        recording_client.save(tmp_path / "recording.json.gz")
+
+    # Only the changed project was fetched, every other one came from the cache
+    assert recorded.get_project_details(3)["acl_group"] == "changed"
+    assert _replay(tmp_path / "recording.json.gz") == recorded
+
+
+def test_replay_fails_on_requests_that_were_not_recorded(tmp_path: Path):
+    with FakeManager(generate_fleet(5)) as manager:
+        client = RecordingManagerClient(manager.url)
+        client.get_projects()
+        client.save(tmp_path / "recording.json.gz")
+
+    with pytest.raises(LookupError, match="no response for /v1/"):
+        _replay(tmp_path / "recording.json.gz")
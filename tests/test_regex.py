@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import random
+import re
+
+import pytest
+
+from prometheus_configurator.regex import compact_alternation, escape
+
+# Includes every character with a special meaning in either regex syntax
+ALPHABET = "ab0-.\\*+?()[]{}|^$"
+
+
+def _random_values(rng: random.Random) -> list[str]:
+    values: list[str] = []
+    for _ in range(rng.randint(0, 12)):
+        if values and rng.random() < 0.5:
+            # Prefixes and extensions of existing values
+            value = rng.choice(values)
+            if rng.random() < 0.5:
+                value = value[: rng.randint(0, len(value))]
+            else:
+                value += "".join(rng.choices(ALPHABET, k=rng.randint(1, 3)))
+        else:
+            value = "".join(rng.choices(ALPHABET, k=rng.randint(0, 6)))
+        values.append(value)
+    return values
+
+
+def _probes(rng: random.Random, values: list[str]) -> set[str]:
+    probes = set(values)
+    for value in values:
+        probes.update(value[:i] for i in range(len(value)))
+        probes.update(value + char for char in ALPHABET)
+        probes.add(value[1:])
+    probes.update(
+        "".join(rng.choices(ALPHABET, k=rng.randint(0, 7))) for _ in range(50)
+    )
+    return probes
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_compact_alternation_matches_same_values_as_flat(seed: int):
+    rng = random.Random(seed)
+    values = _random_values(rng)
+
+    flat = re.compile("|".join(escape(value) for value in values))
+    compact = re.compile(compact_alternation(values))
+
+    for probe in _probes(rng, values):
+        # Prometheus anchors relabel regexes at both ends
+        assert bool(compact.fullmatch(probe)) == bool(flat.fullmatch(probe)), probe
+
+
+def test_compact_alternation_shares_prefixes():
+    assert compact_alternation(["abc", "abd", "ab"]) == "ab(?:[cd])?"
@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import subprocess
+
+import pytest
+
+from prometheus_configurator import reload
+from prometheus_configurator.reload import ReloadCoordinator
+
+
+class Calls:
+    def __init__(self) -> None:
+        self.calls: list[list[str]] = []
+        self.failures: list[BaseException] = []
+        self.now = 1000.0
+
+    def check_call(self, command: list[str]):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.calls.append(command[1:] if command[0] == "/usr/bin/sudo" else command)
+
+
+@pytest.fixture
+def calls(monkeypatch: pytest.MonkeyPatch) -> Calls:
+    calls = Calls()
+    monkeypatch.setattr(reload.subprocess, "check_call", calls.check_call)
+    monkeypatch.setattr(reload.time, "monotonic", lambda: calls.now)
+    return calls
+
+
+def test_intents_are_deduplicated(calls: Calls):
+    reloader = ReloadCoordinator()
+    # Like two outputs both asking for a Prometheus reload
+    reloader.reload_unit("prometheus")
+    reloader.reload_unit("prometheus")
+    reloader.reload_unit("alertmanager")
+
+    reloader.execute()
+    reloader.execute()
+
+    assert calls.calls == [
+        ["/usr/bin/systemctl", "reload", "prometheus", "alertmanager"]
+    ]
+
+
+def test_restart_replaces_reload(calls: Calls):
+    reloader = ReloadCoordinator()
+    reloader.reload_unit("prometheus")
+    reloader.restart_unit("prometheus")
+    reloader.reload_unit("alertmanager")
+
+    reloader.execute()
+
+    assert calls.calls == [
+        ["/usr/bin/systemctl", "restart", "prometheus"],
+        ["/usr/bin/systemctl", "reload", "alertmanager"],
+    ]
+
+
+def test_reloads_within_min_interval_are_postponed(calls: Calls):
+    reloader = ReloadCoordinator(min_interval=60)
+    reloader.reload_unit("prometheus")
+    reloader.execute()
+
+    calls.now += 30
+    reloader.reload_unit("prometheus")
+    reloader.reload_unit("prometheus")
+    reloader.execute()
+    assert len(calls.calls) == 1
+
+    calls.now += 30
+    reloader.execute()
+    assert len(calls.calls) == 2
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        subprocess.CalledProcessError(1, "systemctl"),
+        FileNotFoundError("/usr/bin/sudo"),
+        PermissionError("/usr/bin/sudo"),
+    ],
+)
+def test_failed_reloads_are_retried(calls: Calls, failure: BaseException):
+    reloader = ReloadCoordinator(min_interval=60)
+    reloader.reload_unit("prometheus")
+    calls.failures.append(failure)
+
+    with pytest.raises(RuntimeError, match="1 reload actions failed"):
+        reloader.execute()
+    assert calls.calls == []
+
+    # A failed reload does not count towards min_interval either
+    reloader.execute()
+    assert calls.calls == [["/usr/bin/systemctl", "reload", "prometheus"]]
+
+
+def test_dry_run_does_nothing(calls: Calls):
+    reloader = ReloadCoordinator(dry_run=True)
+    reloader.reload_unit("prometheus")
+    reloader.run_command(["/usr/bin/sudo", "/usr/local/bin/blackbox-reload"])
+
+    reloader.execute()
+
+    assert calls.calls == []
@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from prometheus_configurator.prometheus import ConfigFileCreator
+
+
+def _group_of_rules(creator: ConfigFileCreator, count: int) -> dict[str, str]:
+    rules = [{"alert": f"Alert{i}", "expr": "up == 0"} for i in range(count)]
+    return {
+        rule["alert"]: group["name"]
+        for group in creator._create_rule_groups("tools", rules)
+        for rule in group["rules"]
+    }
+
+
+def test_rules_are_not_split_without_limits():
+    groups = ConfigFileCreator({})._create_rule_groups(
+        "tools", [{"alert": f"Alert{i}", "expr": "up"} for i in range(100)]
+    )
+    assert [group["name"] for group in groups] == ["tools"]
+
+
+def test_adding_rules_keeps_the_groups_of_existing_rules():
+    creator = ConfigFileCreator({"rule_groups": {"max_rules": 10}})
+
+    before = _group_of_rules(creator, 95)
+    after = _group_of_rules(creator, 100)
+
+    assert len(set(before.values())) > 1
+    assert all(after[alert] == group for alert, group in before.items())
+
+
+def test_more_groups_only_move_rules_to_the_new_groups():
+    creator = ConfigFileCreator({"rule_groups": {"max_rules": 10}})
+
+    before = _group_of_rules(creator, 100)
+    after = _group_of_rules(creator, 101)
+
+    new_groups = set(after.values()) - set(before.values())
+    assert new_groups
+    assert all(after[alert] in (group, *new_groups) for alert, group in before.items())
+
+
+def test_cost_limit_splits_expensive_rules():
+    creator = ConfigFileCreator({"rule_groups": {"max_cost": 10}})
+    rules = [
+        {"alert": f"Alert{i}", "expr": "rate(a[5m]) / rate(b[5m])"} for i in range(20)
+    ]
+
+    groups = creator._create_rule_groups("tools", rules)
+
+    # Each rule costs 5, so they are hashed into 10 groups, some of which may
+    # end up empty and are left out
+    assert 5 < len(groups) <= 10
+    assert sorted(rule["alert"] for group in groups for rule in group["rules"]) == (
+        sorted(rule["alert"] for rule in rules)
+    )
@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from benchmarks.fleet import FakeManager, create_main_config, generate_fleet
+from prometheus_configurator import serialization
+from prometheus_configurator.runner import Runner
+
+
+@pytest.fixture
+def manager() -> Iterator[FakeManager]:
+    with FakeManager(generate_fleet(5)) as manager:
+        yield manager
+
+
+def _write_config(path: Path, config: dict[str, Any]):
+    mtime = path.stat().st_mtime if path.exists() else 0
+    path.write_text(serialization.dump(config))
+    # Make the change visible even on file systems with coarse timestamps
+    os.utime(path, (mtime + 10, mtime + 10))
+
+
+@pytest.fixture
+def config(tmp_path: Path, manager: FakeManager) -> dict[str, Any]:
+    (tmp_path / "prometheus").mkdir()
+    config = {
+        **create_main_config(tmp_path),
+        "manager": {"url": manager.url, "cache_ttl": 0},
+        "outputs": [
+            {
+                "kind": "prometheus",
+                "base_directory": str(tmp_path / "prometheus"),
+                "fqdn_template": "{instance}.{project}.example.org",
+            },
+            {"kind": "karma_acl", "acl_file_path": str(tmp_path / "acl.yml")},
+        ],
+    }
+    _write_config(tmp_path / "config.yaml", config)
+    return config
+
+
+def _skipped(caplog: pytest.LogCaptureFixture, runner: Runner) -> list[str]:
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger="prometheus_configurator.runner"):
+        runner.run_once()
+    return sorted(
+        message.split()[2]
+        for message in caplog.messages
+        if message.endswith("are unchanged, skipping")
+    )
+
+
+def test_unchanged_outputs_are_skipped(
+    tmp_path: Path, config: dict, caplog: pytest.LogCaptureFixture
+):
+    runner = Runner([str(tmp_path / "config.yaml")], skip_unchanged=True)
+
+    assert _skipped(caplog, runner) == []
+    assert _skipped(caplog, runner) == ["karma_acl", "prometheus"]
+
+
+def test_changed_input_files_are_noticed(
+    tmp_path: Path, config: dict, caplog: pytest.LogCaptureFixture
+):
+    runner = Runner([str(tmp_path / "config.yaml")], skip_unchanged=True)
+    _skipped(caplog, runner)
+
+    credentials = tmp_path / "openstack.yaml"
+    credentials.write_text(credentials.read_text().replace("password", "secret"))
+
+    assert _skipped(caplog, runner) == ["karma_acl"]
+    assert "secret" in (tmp_path / "prometheus" / "prometheus.yml").read_text()
+
+
+def test_changed_main_config_is_reloaded(
+    tmp_path: Path, config: dict, caplog: pytest.LogCaptureFixture
+):
+    runner = Runner([str(tmp_path / "config.yaml")], skip_unchanged=True)
+    _skipped(caplog, runner)
+
+    _write_config(
+        tmp_path / "config.yaml", {**config, "project_group_format": "group-{project}"}
+    )
+
+    assert _skipped(caplog, runner) == []
+    assert "group-project-1" in (tmp_path / "acl.yml").read_text()
+
+
+def test_changed_manager_data_is_noticed(
+    tmp_path: Path, config: dict, manager: FakeManager, caplog: pytest.LogCaptureFixture
+):
+    runner = Runner([str(tmp_path / "config.yaml")], skip_unchanged=True)
+    _skipped(caplog, runner)
+
+    manager.fleet.images.append({"openstack_id": "new-image"})
+
+    # Only the Prometheus output uses the images
+    assert _skipped(caplog, runner) == ["karma_acl"]
+    assert "new-image" in (tmp_path / "prometheus" / "prometheus.yml").read_text()
+
+
+def test_replay_needs_an_output_root(tmp_path: Path):
+    with pytest.raises(ValueError, match="output root"):
+        Runner([str(tmp_path / "config.yaml")], replay_path=tmp_path / "recording")
+
+
+def test_replay_does_not_touch_the_configured_paths(
+    tmp_path: Path, config: dict, manager: FakeManager
+):
+    recording = tmp_path / "recording.json.gz"
+    Runner([str(tmp_path / "config.yaml")], record_path=recording).run_once()
+    live = (tmp_path / "prometheus" / "prometheus.yml").read_text()
+
+    manager.fleet.images.append({"openstack_id": "new-image"})
+    Runner(
+        [str(tmp_path / "config.yaml")],
+        replay_path=recording,
+        output_root=tmp_path / "root",
+    ).run_once()
+
+    assert (tmp_path / "prometheus" / "prometheus.yml").read_text() == live
+    # Generated from the recording rather than the current manager data
+    replayed = next((tmp_path / "root").rglob("prometheus.yml")).read_text()
+    assert (
+        serialization.load(replayed)["scrape_configs"]
+        == serialization.load(live)["scrape_configs"]
+    )
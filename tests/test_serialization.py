@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+import io
+from pathlib import Path
+
+import pytest
+import yaml
+
+from benchmarks.fleet import create_main_config
+from prometheus_configurator import serialization
+from prometheus_configurator.prometheus import ConfigFileCreator
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+
+@pytest.fixture
+def prometheus_config(
+    tmp_path: Path, snapshot: ManagerSnapshot
+) -> tuple[dict, ConfigFileCreator]:
+    creator = ConfigFileCreator(create_main_config(tmp_path))
+    config, _ = creator.create_prometheus_config(
+        snapshot.projects,
+        snapshot,
+        ["/etc/prometheus/rules/*.yml"],
+        {
+            "blackbox_address": "localhost:9115",
+            "fqdn_template": "{instance}.{project}.example.org",
+        },
+    )
+    return config, creator
+
+
+def test_dump_with_aliases_loads_back_as_the_same_data(prometheus_config):
+    config, creator = prometheus_config
+
+    aliased = serialization.dump_with_aliases(
+        config, merge_bases=[creator.openstack_credentials]
+    )
+
+    assert "<<: *" in aliased
+    assert len(aliased) < len(serialization.dump(config))
+    assert serialization.load(aliased) == config
+
+
+def test_dump_streaming_matches_dump(prometheus_config):
+    config, _ = prometheus_config
+    rest = {key: value for key, value in config.items() if key != "scrape_configs"}
+
+    stream = io.StringIO()
+    serialization.dump_streaming(
+        rest, "scrape_configs", iter(config["scrape_configs"]), stream
+    )
+
+    assert stream.getvalue() == serialization.dump(config)
+
+
+def test_excessive_aliasing_is_detected():
+    # Almost every node comes from expanding an alias
+    item = {"a": 1, "b": 2, "c": 3, "d": 4}
+    data = [dict(item) for _ in range(50_000)]
+
+    assert serialization.has_excessive_aliasing(
+        serialization.share_equal_structures(data)
+    )
+
+
+def test_small_documents_may_be_mostly_aliases():
+    item = {"a": 1, "b": 2, "c": 3, "d": 4}
+    data = [dict(item) for _ in range(1_000)]
+
+    assert not serialization.has_excessive_aliasing(
+        serialization.share_equal_structures(data)
+    )
+    assert serialization.dump_with_aliases(data) != serialization.dump(data)
+
+
+def test_dump_with_aliases_falls_back_on_excessive_aliasing(monkeypatch):
+    monkeypatch.setattr(serialization, "has_excessive_aliasing", lambda data: True)
+    data = [{"a": 1, "b": 2, "c": 3, "d": i // 5} for i in range(10)]
+
+    assert serialization.dump_with_aliases(data) == serialization.dump(data)
+
+
+@pytest.mark.skipif(
+    serialization.SafeDumper is yaml.SafeDumper, reason="libyaml is not installed"
+)
+def test_dump_does_not_depend_on_libyaml(
+    tmp_path: Path, snapshot: ManagerSnapshot, prometheus_config
+):
+    for project in snapshot.projects:
+        for rule in snapshot.get_project_details(project["id"])["alert_rules"]:
+            rule["annotations"] = {
+                "summary": f"Instanz von {project['name']} ist nicht erreichbar ✗",
+                "description": "Überprüfe die Instanz – 🔥 "
+                + "sehr lange Beschreibung mit Umlauten äöü " * 5,
+            }
+    creator = ConfigFileCreator(create_main_config(tmp_path))
+    config, _ = prometheus_config
+
+    for data in [
+        config,
+        *creator.create_rule_files(snapshot.projects, snapshot).values(),
+    ]:
+        assert serialization.dump(data) == yaml.dump(
+            data, Dumper=yaml.SafeDumper, width=serialization.WIDTH
+        )
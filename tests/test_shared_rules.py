@@ -0,0 +1,136 @@
+# SPDX-FileCopyrightText: 2021-2024 Taavi Väänänen <hi@taavi.wtf>
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.fleet import create_main_config
+from prometheus_configurator.prometheus import (
+    SHARED_RECORDING_RULES_FILE,
+    ConfigFileCreator,
+    normalize_expr,
+    shared_expression_saving,
+)
+from prometheus_configurator.snapshot import ManagerSnapshot
+
+SHARED = 'rate(http_errors_total{code="500"}[5m]) > 1'
+# The same expression, formatted differently
+SHARED_REFORMATTED = 'rate(http_errors_total{code="500"} [5m])\n  > 1 # too many'
+# Only differs from the shared one after a comment
+COMMENTED_OUT = 'rate(http_errors_total{code="500"}[5m]) > 1 # x\nor vector(1)'
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("up == 0", "up==0"),
+        ("a and b", "a  and\nb"),
+        ("up == 0 # down", "up == 0"),
+        ("a # b\nor c", "a or c"),
+    ],
+)
+def test_normalize_expr_matches_equivalent_expressions(first: str, second: str):
+    assert normalize_expr(first) == normalize_expr(second)
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("a and b", "aandb"),
+        ('up{job="a b"}', 'up{job="ab"}'),
+        # The comment hides the rest of the line, but not the next one
+        ("a # b\nor c", "a # b or c"),
+        ('up{job="#"} or c', 'up{job="#"}'),
+        ("up{job=`a#`} or c", "up{job=`a#`}"),
+    ],
+)
+def test_normalize_expr_keeps_meaningful_differences(first: str, second: str):
+    assert normalize_expr(first) != normalize_expr(second)
+
+
+def test_expressions_without_ranges_are_not_worth_sharing():
+    assert shared_expression_saving(cost=1, uses=100) < 0
+    assert shared_expression_saving(cost=3, uses=2) > 0
+
+
+def _snapshot(exprs: list[str]) -> ManagerSnapshot:
+    projects: list[dict[str, Any]] = [
+        {"id": i, "name": f"project-{i}", "extra_labels": {}} for i in range(len(exprs))
+    ]
+    return ManagerSnapshot(
+        projects=projects,
+        project_details={
+            project["id"]: {
+                **project,
+                "scrapes": [],
+                "alert_rules": [
+                    {
+                        "name": "Errors",
+                        "expr": expr,
+                        "duration": "5m",
+                        "severity": "warn",
+                        "annotations": {"summary": "Errors"},
+                    },
+                    {"name": "Down", "expr": "up == 0", "severity": "warn"},
+                ],
+            }
+            for project, expr in zip(projects, exprs)
+        },
+        contact_groups=[],
+        supported_openstack_images=[],
+        global_alerts=[],
+    )
+
+
+def _rule_files(
+    tmp_path: Path, snapshot: ManagerSnapshot, shared: bool
+) -> dict[str, Any]:
+    creator = ConfigFileCreator(
+        {**create_main_config(tmp_path), "shared_recording_rules": shared}
+    )
+    return creator.create_rule_files(snapshot.projects, snapshot)
+
+
+def _alerts(rule_files: dict[str, Any]) -> dict[str, dict]:
+    return {
+        rule["alert"]: rule
+        for name, rule_file in rule_files.items()
+        if name.startswith("alerts_project_")
+        for group in rule_file["groups"]
+        for rule in group["rules"]
+    }
+
+
+def test_shared_alerts_fire_on_the_same_series(tmp_path: Path):
+    snapshot = _snapshot([SHARED, SHARED_REFORMATTED, SHARED, COMMENTED_OUT])
+    original = _alerts(_rule_files(tmp_path, snapshot, shared=False))
+    rule_files = _rule_files(tmp_path, snapshot, shared=True)
+    rewritten = _alerts(rule_files)
+
+    records = {
+        rule["record"]: rule
+        for group in rule_files[SHARED_RECORDING_RULES_FILE]["groups"]
+        for rule in group["rules"]
+    }
+    assert len(records) == 1
+
+    assert rewritten.keys() == original.keys()
+    for name, alert in rewritten.items():
+        if alert["expr"] == original[name]["expr"]:
+            continue
+
+        # The recorded series only differ from the ones of the expression by
+        # their name, which alerts do not keep anyway
+        record = records[alert["expr"]]
+        assert record.keys() == {"record", "expr"}
+        assert normalize_expr(record["expr"]) == normalize_expr(original[name]["expr"])
+        assert {**alert, "expr": None} == {**original[name], "expr": None}
+
+    shared = {name for name, alert in rewritten.items() if alert["expr"] in records}
+    assert shared == {f"Project{i}Errors" for i in range(3)}
+    # Cheap to evaluate, so not shared
+    assert rewritten["Project0Down"]["expr"] == "up == 0"